@@ -17,7 +17,9 @@ import shutil
 from threading import Timer
 import logging
 import re
-from collections import defaultdict
+import multiprocessing
+from collections import defaultdict, namedtuple
+from itertools import groupby
 import numpy as np
 import subprocess
 import time
@@ -42,8 +44,10 @@ from expense_categories import (
     classify_transaction,
     get_category_statistics,
     format_category_report,
-    EXPENSE_CATEGORIES,
-    classify_alrajhi_transaction  # إضافة هذا إذا كان موجوداً في expense_categories
+    get_keyword_index,
+    get_ruleset_version,
+    keyword_index_snapshot,
+    classify_many
 )
 
 # ==================== دوال ngrok وتشغيل الخادم ====================
@@ -138,6 +142,11 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024  # 32 MB max file size
 app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+# عدد العمليات لاستخراج صفحات PyMuPDF، وأقل عدد صفحات لاستخدامها (الكشوف الأقصر في نفس العملية)
+# الافتراضي 1 (بدون توازي) كما في CLASSIFICATION_WORKERS: كل كشف مؤهل ينشئ Pool جديداً بـ fork من خيط الطلب
+# بينما قد تحمل خيوط أخرى (كاتب المتعلم ومراقب ملف التصنيفات) أقفالها
+app.config['EXTRACTION_WORKERS'] = int(os.environ.get('EXTRACTION_WORKERS', 1))
+app.config['PARALLEL_EXTRACTION_MIN_PAGES'] = int(os.environ.get('PARALLEL_EXTRACTION_MIN_PAGES', 16))
 
 # قاموس لحفظ الروابط النشطة
 active_links = {}
@@ -537,24 +546,30 @@ def clean_description(desc):
     
     return desc
 
-def classify_expense_enhanced(desc, mcc=None, bank=None):
-    """تصنيف المصروف باستخدام النظام الجديد ثنائي المستوى"""
-    if not desc:
-        return "❓ غير مصنف"
-    
-    # تحقق من نوع البنك وإذا كان الراجحي استخدم دالة خاصة
-    if bank == 'الراجحي' and 'classify_alrajhi_transaction' in globals():
-        main_category, sub_category = classify_alrajhi_transaction(desc)
-    else:
-        # استخدام دالة التصنيف العامة
-        main_category, sub_category = classify_transaction(desc)
-    
-    # دمج التصنيف الرئيسي والفرعي
+def format_expense_category(main_category, sub_category):
+    """دمج التصنيف الرئيسي والفرعي"""
     if sub_category != "غير محدد":
         return f"{main_category} - {sub_category}"
     else:
         return main_category
 
+def classify_pending_expenses(pending_expenses, expense_details):
+    """
+    تصنيف المصاريف المجمعة بترتيب استخراجها ثم توزيعها على التصنيفات
+    مصاريف جميع البنوك تُصنف في استدعاء واحد (مع بنك كل صف)، فيبقى ترتيب التعلم كما في تصنيفها واحداً بعد الآخر
+    """
+    categories = ["❓ غير مصنف"] * len(pending_expenses)
+    positions = [position for position, (bank, record) in enumerate(pending_expenses) if record["desc"]]
+    
+    if positions:
+        results = classify_many([pending_expenses[position][1]["desc"] for position in positions],
+                                banks=[pending_expenses[position][0] for position in positions])
+        for position, (main_category, sub_category) in zip(positions, results):
+            categories[position] = format_expense_category(main_category, sub_category)
+    
+    for (bank, record), category in zip(pending_expenses, categories):
+        expense_details[category].append(record)
+
 # ==================== دوال الحسابات المالية ====================
 
 def calculate_expense_percentages(expense_details):
@@ -747,84 +762,173 @@ def generate_insights(total_income, total_expenses, expense_details, financial_m
 
 # ==================== دوال استخراج البيانات ====================
 
-def detect_bank_type(pdf_path):
-    """كشف نوع البنك من محتوى PDF"""
+# إعدادات pdfplumber لاستخراج جداول الكشوف في مسار العودة
+PLUMBER_TABLE_SETTINGS = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines",
+    "snap_tolerance": 3,
+    "join_tolerance": 3,
+    "edge_min_length": 50,
+    "min_words_vertical": 0,
+    "min_words_horizontal": 0,
+    "text_tolerance": 3,
+    "text_x_tolerance": 3,
+    "text_y_tolerance": 3,
+    "intersection_tolerance": 3,
+}
+
+class PDFDocument:
+    """
+    مستند PDF يُفتح مرة واحدة طوال التحليل (كشف البنك، الاستخراج، ومسار العودة)
+    مع حفظ نص وجداول كل صفحة حتى لا تُحلل أي صفحة مرتين
+    """
+    
+    def __init__(self, pdf_path):
+        self.path = pdf_path
+        self.bank_type = None  # نتيجة كشف البنك بعد أول استدعاء
+        self._plumber = None
+        self._mupdf = None
+        self._cache = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        if self._plumber is not None:
+            self._plumber.close()
+            self._plumber = None
+        if self._mupdf is not None:
+            self._mupdf.close()
+            self._mupdf = None
+        self._cache.clear()
+    
+    @property
+    def plumber(self):
+        """المستند مفتوحاً بواسطة pdfplumber (عند أول حاجة إليه)"""
+        if self._plumber is None:
+            self._plumber = pdfplumber.open(self.path)
+        return self._plumber
+    
+    @property
+    def mupdf(self):
+        """المستند مفتوحاً بواسطة PyMuPDF (عند أول حاجة إليه)"""
+        if self._mupdf is None:
+            self._mupdf = fitz.open(self.path)
+        return self._mupdf
+    
+    @property
+    def page_count(self):
+        return len(self.plumber.pages)
+    
+    def _cached(self, key, compute):
+        try:
+            return self._cache[key]
+        except KeyError:
+            value = self._cache[key] = compute()
+            return value
+    
+    def page_text(self, page_num):
+        """نص الصفحة من pdfplumber"""
+        return self._cached(('text', page_num),
+                            lambda: self.plumber.pages[page_num].extract_text() or "")
+    
+    def page_tables(self, page_num, settings=None):
+        """جداول الصفحة من pdfplumber (لكل مجموعة إعدادات)"""
+        settings_key = tuple(sorted(settings.items())) if settings else None
+        return self._cached(('tables', page_num, settings_key),
+                            lambda: self.plumber.pages[page_num].extract_tables(settings))
+    
+    def mupdf_text(self, page_num):
+        """نص الصفحة من PyMuPDF"""
+        return self._cached(('mupdf_text', page_num), lambda: self.mupdf[page_num].get_text())
+    
+    def mupdf_tables(self, page_num):
+        """نتيجة find_tables للصفحة من PyMuPDF"""
+        return self._cached(('mupdf_tables', page_num), lambda: self.mupdf[page_num].find_tables())
+    
+    def release_page(self, page_num):
+        """تحرير ما حُفظ للصفحة بعد استهلاك معاملاتها (التحليل يمر على الصفحات مرة واحدة)"""
+        for key in [key for key in self._cache if key[1] == page_num]:
+            del self._cache[key]
+        if self._plumber is not None:
+            self._plumber.pages[page_num].flush_cache()
+
+def detect_bank_type(document):
+    """كشف نوع البنك من محتوى PDF (يقبل PDFDocument أو مسار الملف)"""
+    if not isinstance(document, PDFDocument):
+        with PDFDocument(document) as opened:
+            return detect_bank_type(opened)
+    
+    if document.bank_type is None:
+        document.bank_type = _detect_bank_type(document)
+    return document.bank_type
+
+def _find_bank_signature(text):
+    """
+    مرور واحد على النص لجميع البصمات، ويُرجع (رقم البنك في السجل، البصمة) أو None
+    الأسبق في السجل يفوز عند وجود أكثر من بنك
+    """
+    found = None
+    for match in BANK_SIGNATURES_PATTERN.finditer(text.lower()):
+        parser_id = int(match.lastgroup[len('bank'):])
+        if found is None or parser_id < found[0]:
+            found = (parser_id, match.group(match.lastgroup))
+            if parser_id == 0:
+                break
+    return found
+
+def _detect_bank_type(document):
+    """
+    فحص بصمات البنوك المسجلة صفحة بصفحة (الأولى غالباً تكفي) ثم تنسيق الكشف ورؤوس الجداول
+    """
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            # فحص أول 3 صفحات للتأكد
-            pages_to_check = min(3, len(pdf.pages))
-            combined_text = ""
-            
-            for i in range(pages_to_check):
-                page_text = pdf.pages[i].extract_text() or ""
-                combined_text += page_text + " "
-            
-            combined_text_lower = combined_text.lower()
-            
-            # تحسين كشف بنك الراجحي - إضافة المؤشرات الصحيحة
-            rajhi_indicators = [
-                'alrajhibank.com', 'alrajhibank.com.sa',  # الموقع الرسمي
-                'alrajhi bank', 'مصرف الراجحي',
-                '920 003 344',  # رقم الهاتف المميز للراجحي
-                'الراجحي', 'alrajhi', 'al rajhi', 'al-rajhi',
-                'مصرف الراجحي', 'al rajhi bank', 'الراجحي المصرفية',
-                'alrajhi banking', 'مصرف الراجحي المصرفية',
-                'al rajhi banking', 'شركة الراجحي المصرفية',
-                'rajhi', 'الراجحى', 'al-rajhi bank',
-                'مصرف الراجحى', 'alrajhi bank',
-                # إضافة أرقام وأكواد خاصة بالراجحي
-                '80000', 'rjhi', 'sarb', 'الراجحي للاستثمار',
-                'al rajhi capital', 'الراجحي كابيتال'
-            ]
-            
-            # التحقق من مؤشرات الراجحي
-            for indicator in rajhi_indicators:
-                if indicator in combined_text_lower:
-                    app.logger.info(f"✅ تم اكتشاف بنك الراجحي بواسطة: {indicator}")
-                    return 'الراجحي'
-            
-            # كشف البنك الأهلي
-            ahli_indicators = [
-                'الأهلي', 'الاهلي', 'ahli', 'al ahli', 'البنك الأهلي',
-                'البنك الاهلي', 'national bank', 'snb', 'الأهلي السعودي',
-                'البنك الأهلي السعودي', 'saudi national bank',
-                'البنك الاهلي التجاري', 'ncb', 'الاهلي التجاري'
-            ]
-            
-            for indicator in ahli_indicators:
-                if indicator in combined_text_lower:
-                    app.logger.info(f"✅ تم اكتشاف البنك الأهلي بواسطة: {indicator}")
-                    return 'الأهلي'
-            
-            # البحث عن أنماط خاصة في تنسيق الكشف
-            # الراجحي يستخدم جدول بتنسيق: التاريخ | تفاصيل العملية | مدين | دائن | الرصيد
-            if 'تفاصيل العملية' in combined_text and 'مدين' in combined_text and 'دائن' in combined_text and 'الرصيد' in combined_text:
-                # التحقق من وجود "Statement Details" و "تفاصيل الكشف" معاً (خاص بالراجحي)
-                if 'statement details' in combined_text_lower and 'تفاصيل الكشف' in combined_text:
-                    app.logger.info("✅ تم اكتشاف بنك الراجحي من خلال تنسيق الكشف الثنائي اللغة")
-                    return 'الراجحي'
+        # فحص أول 3 صفحات للتأكد، مع التوقف مبكراً فقط عند بصمة البنك الأعلى أولوية (الراجحي)
+        pages_to_check = min(3, len(document.mupdf) if PYMUPDF_AVAILABLE else document.page_count)
+        combined_text = ""
+        
+        for i in range(pages_to_check):
+            page_text = document.mupdf_text(i) if PYMUPDF_AVAILABLE else document.page_text(i)
+            combined_text += page_text + " "
             
-            # محاولة أخرى: البحث عن أنماط خاصة بكل بنك في الجداول
-            for page in pdf.pages[:pages_to_check]:
-                tables = page.extract_tables()
-                for table in tables:
-                    if not table:
-                        continue
-                    
-                    # فحص رأس الجدول
-                    if len(table) > 0:
-                        header_row = ' '.join(str(cell) for cell in table[0] if cell).lower()
-                        
-                        # نمط الراجحي: التاريخ | تفاصيل العملية | مدين | دائن | الرصيد
-                        if all(word in header_row for word in ['تاريخ', 'تفاصيل', 'مدين', 'دائن', 'رصيد']):
-                            app.logger.info("✅ تم اكتشاف بنك الراجحي من خلال تنسيق رأس الجدول")
-                            return 'الراجحي'
-                        
-                        # نمط الأهلي: يختلف عن الراجحي
-                        if 'transaction' in header_row and 'description' in header_row:
-                            app.logger.info("✅ تم اكتشاف البنك الأهلي من خلال تنسيق رأس الجدول")
-                            return 'الأهلي'
+            found = _find_bank_signature(page_text)
+            if found and found[0] == 0:
+                break
+        else:
+            # بصمة بنك أقل أولوية في صفحة لا تحسم: قد تظهر بصمة الراجحي في صفحة لاحقة
+            found = _find_bank_signature(combined_text)
+        
+        if found:
+            parser = BANK_PARSERS[found[0]]
+            app.logger.info(f"✅ تم اكتشاف {parser.title} بواسطة: {found[1]}")
+            return parser.name
+        
+        # البحث عن أنماط خاصة في تنسيق الكشف
+        for parser in BANK_PARSERS:
+            if parser.layout_signature and parser.layout_signature(combined_text):
+                app.logger.info(f"✅ تم اكتشاف {parser.title} من خلال تنسيق الكشف")
+                return parser.name
+        
+        # محاولة أخرى: البحث عن أنماط خاصة بكل بنك في الجداول
+        for page_num in range(pages_to_check):
+            if PYMUPDF_AVAILABLE:
+                # نفس الجداول التي سيستخدمها الاستخراج لاحقاً (محفوظة في المستند)
+                tables = [table.extract() for table in document.mupdf_tables(page_num)]
+            else:
+                tables = document.page_tables(page_num)
+            for table in tables:
+                if not table:
+                    continue
                 
+                # فحص رأس الجدول
+                header_row = ' '.join(str(cell) for cell in table[0] if cell).lower()
+                for parser in BANK_PARSERS:
+                    if parser.header_words and all(word in header_row for word in parser.header_words):
+                        app.logger.info(f"✅ تم اكتشاف {parser.title} من خلال تنسيق رأس الجدول")
+                        return parser.name
+            
     except Exception as e:
         app.logger.error(f"❌ خطأ في كشف نوع البنك: {str(e)}")
     
@@ -853,139 +957,201 @@ def extract_transaction_from_line(line):
     
     return None
 
-def extract_with_pymupdf(pdf_path):
-    """استخراج النصوص باستخدام PyMuPDF"""
-    if not PYMUPDF_AVAILABLE:
-        return None
+def _parse_sar_text_lines(lines):
+    """
+    معاملات صفحة من نصها عند غياب الجداول: قسم يبدأ برأس "التاريخ ... تفاصيل العملية"،
+    وكل معاملة تبدأ بتاريخ (YYYY/MM/DD) وتمتد حتى 5 أسطر وفيها المبلغ متبوعاً بـ SAR
+    """
+    page_data = []
     
-    try:
-        doc = fitz.open(pdf_path)
-        all_data = []
+    # البحث عن نمط المعاملات في النص
+    in_transaction_section = False
+    
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
         
-        # كشف نوع البنك
-        bank_type = detect_bank_type(pdf_path)
-        app.logger.info(f"🏦 PyMuPDF: نوع البنك = {bank_type}")
+        # بداية قسم المعاملات
+        if 'التاريخ' in line and 'تفاصيل العملية' in line:
+            in_transaction_section = True
+            continue
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            
-            # محاولة استخراج الجداول
-            tables = page.find_tables()
-            
-            if tables:
-                for table in tables:
-                    table_data = table.extract()
-                    
-                    # تخطي الصف الأول إذا كان عناوين
-                    start_row = 0
-                    if table_data and len(table_data) > 0:
-                        first_row_text = ' '.join(str(cell) for cell in table_data[0] if cell).lower()
-                        if any(header in first_row_text for header in ['تاريخ', 'date', 'مدين', 'دائن', 'الرصيد', 'تفاصيل']):
-                            start_row = 1
-                    
-                    for row_idx in range(start_row, len(table_data)):
-                        row = table_data[row_idx]
-                        if not row or len(row) < 4:
-                            continue
-                        
-                        if bank_type == 'الراجحي':
-                            # معالجة خاصة للراجحي
-                            transaction = extract_alrajhi_transaction(row)
-                            if transaction:
-                                all_data.append({
-                                    'date': transaction['date'],
-                                    'desc': transaction['desc'],
-                                    'amount': transaction['amount'],
-                                    'type': transaction['type']
-                                })
-                        else:
-                            # معالجة للبنوك الأخرى
-                            if len(row) >= 3:
-                                all_data.append({
-                                    'date': fix_arabic_text_advanced(str(row[0])),
-                                    'desc': fix_arabic_text_advanced(str(row[1])),
-                                    'amount': str(row[2]) if len(row) > 2 else ''
-                                })
-            else:
-                # إذا لم توجد جداول، استخرج من النص
-                text = page.get_text()
-                lines = text.split('\n')
+        if in_transaction_section:
+            # محاولة استخراج معاملة من السطر
+            # نمط التاريخ
+            date_match = re.search(r'(\d{4}/\d{2}/\d{2})', line)
+            if date_match:
+                # جمع الأسطر التالية للحصول على التفاصيل الكاملة
+                transaction_lines = [line]
                 
-                # البحث عن نمط المعاملات في النص
-                in_transaction_section = False
+                # جمع الأسطر التالية حتى نجد تاريخ جديد أو نهاية
+                j = i + 1
+                while j < len(lines) and not re.search(r'^\d{4}/\d{2}/\d{2}', lines[j]):
+                    if lines[j].strip():
+                        transaction_lines.append(lines[j].strip())
+                    j += 1
+                    if j - i > 5:  # حد أقصى 5 أسطر للمعاملة الواحدة
+                        break
                 
-                for i, line in enumerate(lines):
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    # بداية قسم المعاملات
-                    if 'التاريخ' in line and 'تفاصيل العملية' in line:
-                        in_transaction_section = True
+                # دمج الأسطر
+                full_transaction = ' '.join(transaction_lines)
+                
+                # استخراج المبلغ
+                amount_match = re.search(r'([\d,]+\.?\d*)\s*SAR', full_transaction)
+                if amount_match:
+                    try:
+                        amount_str = amount_match.group(1).replace(',', '')
+                        amount = float(amount_str)
+                        
+                        # تحديد نوع المعاملة
+                        if 'دائن' in full_transaction or 'حوالة واردة' in full_transaction:
+                            transaction_type = 'income'
+                        else:
+                            transaction_type = 'expense'
+                            amount = -amount
+                        
+                        # استخراج التفاصيل
+                        desc_start = full_transaction.find('SAR') + 3
+                        desc = full_transaction[desc_start:].strip()
+                        
+                        if not desc:
+                            # محاولة استخراج من مكان آخر
+                            desc_parts = full_transaction.split('SAR')
+                            if len(desc_parts) > 1:
+                                desc = desc_parts[-1].strip()
+                        
+                        page_data.append({
+                            'date': date_match.group(1),
+                            'desc': fix_arabic_text_advanced(desc) if desc else "عملية بنكية",
+                            'amount': amount,
+                            'type': transaction_type
+                        })
+                    except ValueError:
                         continue
-                    
-                    if in_transaction_section:
-                        # محاولة استخراج معاملة من السطر
-                        # نمط التاريخ
-                        date_match = re.search(r'(\d{4}/\d{2}/\d{2})', line)
-                        if date_match:
-                            # جمع الأسطر التالية للحصول على التفاصيل الكاملة
-                            transaction_lines = [line]
-                            
-                            # جمع الأسطر التالية حتى نجد تاريخ جديد أو نهاية
-                            j = i + 1
-                            while j < len(lines) and not re.search(r'^\d{4}/\d{2}/\d{2}', lines[j]):
-                                if lines[j].strip():
-                                    transaction_lines.append(lines[j].strip())
-                                j += 1
-                                if j - i > 5:  # حد أقصى 5 أسطر للمعاملة الواحدة
-                                    break
-                            
-                            # دمج الأسطر
-                            full_transaction = ' '.join(transaction_lines)
-                            
-                            # استخراج المبلغ
-                            amount_match = re.search(r'([\d,]+\.?\d*)\s*SAR', full_transaction)
-                            if amount_match:
-                                try:
-                                    amount_str = amount_match.group(1).replace(',', '')
-                                    amount = float(amount_str)
-                                    
-                                    # تحديد نوع المعاملة
-                                    if 'دائن' in full_transaction or 'حوالة واردة' in full_transaction:
-                                        transaction_type = 'income'
-                                    else:
-                                        transaction_type = 'expense'
-                                        amount = -amount
-                                    
-                                    # استخراج التفاصيل
-                                    desc_start = full_transaction.find('SAR') + 3
-                                    desc = full_transaction[desc_start:].strip()
-                                    
-                                    if not desc:
-                                        # محاولة استخراج من مكان آخر
-                                        desc_parts = full_transaction.split('SAR')
-                                        if len(desc_parts) > 1:
-                                            desc = desc_parts[-1].strip()
-                                    
-                                    all_data.append({
-                                        'date': date_match.group(1),
-                                        'desc': fix_arabic_text_advanced(desc) if desc else "عملية بنكية",
-                                        'amount': amount,
-                                        'type': transaction_type
-                                    })
-                                except:
-                                    continue
-        
-        doc.close()
-        
-        app.logger.info(f"✅ PyMuPDF: تم استخراج {len(all_data)} معاملة")
-        return all_data
-        
-    except Exception as e:
-        app.logger.error(f"❌ خطأ في PyMuPDF: {str(e)}")
+    
+    return page_data
+
+def _extract_page_pymupdf(document, parser, page_num):
+    """معاملات صفحة واحدة بترتيبها (من جداول PyMuPDF، أو من النص إذا لم توجد جداول ودعمه البنك)"""
+    page_data = []
+    
+    # محاولة استخراج الجداول
+    tables = document.mupdf_tables(page_num)
+    
+    if tables:
+        for table in tables:
+            table_data = table.extract()
+            
+            # تخطي الصف الأول إذا كان عناوين
+            start_row = 0
+            if table_data and len(table_data) > 0:
+                first_row_text = ' '.join(str(cell) for cell in table_data[0] if cell).lower()
+                if any(header in first_row_text for header in parser.table_header_words):
+                    start_row = 1
+            
+            for row_idx in range(start_row, len(table_data)):
+                row = table_data[row_idx]
+                if not row or len(row) < 4:
+                    continue
+                
+                # تخطيط الأعمدة حسب البنك
+                item = parser.extract_row(row)
+                if item:
+                    page_data.append(item)
+    elif parser.parse_page_text is not None:
+        # إذا لم توجد جداول، استخرج من النص
+        page_data = parser.parse_page_text(document.mupdf_text(page_num).split('\n'))
+    
+    return page_data
+
+def _extract_page_range(task):
+    """
+    عملية فرعية: تفتح المستند بنفسها وتستخرج نطاق صفحات، وكل معاملة موسومة
+    برقم صفحتها وترتيبها داخل الصفحة حتى يُعاد ترتيب النتائج المدمجة
+    """
+    pdf_path, bank_type, start, stop = task
+    with PDFDocument(pdf_path) as document:
+        document.bank_type = bank_type
+        parser = get_bank_parser(bank_type)
+        tagged = []
+        for page_num in range(start, stop):
+            for row_idx, item in enumerate(_extract_page_pymupdf(document, parser, page_num)):
+                tagged.append((page_num, row_idx, item))
+            document.release_page(page_num)
+        return tagged
+
+def _iter_pages_parallel(document, parser, page_count, workers):
+    """
+    توزيع الصفحات على عمليات فرعية (fork) بنطاقات متتالية صغيرة وإعادة معاملاتها صفحة بصفحة
+    بترتيب المستند أثناء عمل بقية العمليات، أو None إذا تعذر إنشاؤها
+    إذا فشلت عملية فرعية يُكمل الاستخراج في نفس العملية من أول صفحة لم تصل نتيجتها
+    """
+    # عدة نطاقات لكل عملية حتى تصل الصفحات الأولى للمستهلك مبكراً
+    range_size = -(-page_count // (workers * 4))
+    tasks = [(document.path, document.bank_type, start, min(start + range_size, page_count))
+             for start in range(0, page_count, range_size)]
+    
+    try:
+        pool = multiprocessing.get_context('fork').Pool(processes=workers)
+    except OSError:
         return None
     
+    def pages():
+        next_page = 0
+        try:
+            with pool:
+                for task, tagged in zip(tasks, pool.imap(_extract_page_range, tasks)):
+                    tagged.sort(key=lambda entry: (entry[0], entry[1]))
+                    for page_num, entries in groupby(tagged, key=lambda entry: entry[0]):
+                        yield page_num, [item for _, _, item in entries]
+                    next_page = task[3]
+        except Exception as e:
+            app.logger.warning(f"⚠️ فشل الاستخراج المتوازي ({str(e)})، المتابعة في نفس العملية من الصفحة {next_page + 1}")
+            for page_num in range(next_page, page_count):
+                yield page_num, _extract_page_pymupdf(document, parser, page_num)
+    
+    return pages()
+
+def extract_with_pymupdf(document):
+    """
+    استخراج المعاملات باستخدام PyMuPDF صفحة بصفحة (يقبل PDFDocument أو مسار الملف)
+    مولّد يعيد قائمة معاملات كل صفحة، ويحرر بيانات الصفحة بعد استخراجها
+    """
+    if not PYMUPDF_AVAILABLE:
+        return
+    
+    if not isinstance(document, PDFDocument):
+        with PDFDocument(document) as opened:
+            yield from extract_with_pymupdf(opened)
+        return
+    
+    # كشف نوع البنك (محفوظ في المستند إذا سبق كشفه)
+    bank_type = detect_bank_type(document)
+    parser = get_bank_parser(bank_type)
+    app.logger.info(f"🏦 PyMuPDF: نوع البنك = {bank_type}")
+    
+    page_count = len(document.mupdf)
+    workers = min(app.config['EXTRACTION_WORKERS'], page_count)
+    pages = None
+    extracted_count = 0
+    
+    # الكشوف الطويلة تُوزع صفحاتها على عدة عمليات، والقصيرة تبقى في نفس العملية
+    if (workers > 1 and page_count >= app.config['PARALLEL_EXTRACTION_MIN_PAGES']
+            and 'fork' in multiprocessing.get_all_start_methods()):
+        pages = _iter_pages_parallel(document, parser, page_count, workers)
+    
+    if pages is None:
+        pages = ((page_num, _extract_page_pymupdf(document, parser, page_num))
+                 for page_num in range(page_count))
+    
+    for page_num, page_data in pages:
+        document.release_page(page_num)
+        extracted_count += len(page_data)
+        yield page_data
+    
+    app.logger.info(f"✅ PyMuPDF: تم استخراج {extracted_count} معاملة")
+    
 def extract_alrajhi_transaction(row, page_text=None):
     """
     استخراج معاملة من كشف حساب الراجحي
@@ -1186,241 +1352,331 @@ def extract_alrajhi_transaction_from_data(item):
     
     return None
 
-def process_transaction(date, desc, amount, income_details, expense_details):
-    """معالجة معاملة واحدة"""
+def _extract_alrajhi_row(row):
+    """صف جدول الراجحي من PyMuPDF (الأعمدة تُحدد بمحتواها)"""
+    transaction = extract_alrajhi_transaction(row)
+    if transaction:
+        return {
+            'date': transaction['date'],
+            'desc': transaction['desc'],
+            'amount': transaction['amount'],
+            'type': transaction['type']
+        }
+    return None
+
+def _alrajhi_layout_signature(text):
+    """الراجحي يستخدم جدول بتنسيق: التاريخ | تفاصيل العملية | مدين | دائن | الرصيد بعناوين ثنائية اللغة"""
+    return ('تفاصيل العملية' in text and 'مدين' in text and 'دائن' in text and 'الرصيد' in text
+            and 'statement details' in text.lower() and 'تفاصيل الكشف' in text)
+
+def _extract_ahli_row(row):
+    """صف جدول الأهلي من PyMuPDF: التاريخ | الوصف | المبلغ"""
+    return {
+        'date': fix_arabic_text_advanced(str(row[0])),
+        'desc': fix_arabic_text_advanced(str(row[1])),
+        'amount': str(row[2]) if len(row) > 2 else ''
+    }
+
+def _ahli_transaction(date, desc, amount):
+    """معاملة الأهلي من المبلغ بإشارته (الرسوم الموجبة والمبالغ الصفرية لا تُحتسب)"""
     if amount > 0:
-        # دخل
-        income_details.append({
-            "date": date, 
-            "desc": desc, 
-            "amount": amount
-        })
-    else:
-        # مصروف
-        abs_amt = abs(amount)
-        category = classify_expense_enhanced(desc)
-        expense_details[category].append({
-            "date": date, 
-            "desc": desc, 
-            "amount": abs_amt
-        })
+        if any(x in desc.lower() for x in ["ضريبة", "رسوم", "vat", "fee", "charge"]):
+            return None
+        return {"date": date, "desc": desc, "amount": amount, "type": "income"}
+    elif amount < 0:
+        return {"date": date, "desc": desc, "amount": amount, "type": "expense"}
+    return None
 
-def analyze_transactions(pdf_path):
-    """تحليل العمليات من ملف PDF واحد - يدعم البنك الأهلي والراجحي"""
-    income_count = 0
-    expense_count = 0
-    total_income = 0.0
-    total_expense = 0.0
-    skipped_rows = 0
-    total_rows = 0
-    income_details = []
-    expense_details = defaultdict(list)
+def _parse_ahli_item(item):
+    """معاملة الأهلي من بيانات PyMuPDF المستخرجة"""
+    try:
+        amount = float(re.sub(r"[^\d\.-]", "", str(item['amount'])))
+    except:
+        return None
+    
+    desc = item['desc']
+    if not desc or desc == "[نص غير مقروء]":
+        desc = "عملية مصرفية"
+    
+    return _ahli_transaction(item['date'], desc, amount)
+
+def _parse_ahli_table_row(row):
+    """معاملة الأهلي من صف جدول pdfplumber"""
+    if len(row) < 3 or not row[2]:
+        return None
+    
+    date_raw = extract_text_properly(row[0])
+    desc_raw = extract_text_properly(row[1])
+    amount_raw = extract_text_properly(row[2])
+    
+    date = deep_fix_arabic_text(date_raw)
+    desc = deep_fix_arabic_text(desc_raw)
+    
+    if not date or date == "[نص غير مقروء]":
+        date = datetime.now().strftime("%d/%m/%Y")
+    
+    if not desc or desc == "[نص غير مقروء]":
+        desc = "عملية مصرفية"
+    
+    try:
+        amount = float(re.sub(r"[^\d\.-]", "", amount_raw))
+    except:
+        return None
+    
+    return _ahli_transaction(date, desc, amount)
+
+def _parse_text_parts(parts):
+    """معاملة من سطر نصي [التاريخ، الوصف، المبلغ] (صفحات بدون جداول)"""
+    date = deep_fix_arabic_text(parts[0])
+    desc = deep_fix_arabic_text(parts[1])
+    try:
+        amount = float(parts[2])
+    except:
+        return None
+    
+    return {"date": date, "desc": desc, "amount": amount, "type": "income" if amount > 0 else "expense"}
+
+# ==================== سجل محللات البنوك ====================
+
+# لكل بنك: بصمة كشف رخيصة (مؤشرات نصية وتنسيق الكشف ورأس الجدول)، وتخطيط الأعمدة، ومحللات الصفوف
+BankParser = namedtuple('BankParser', [
+    'name',                 # الاسم المستخدم في نوع البنك
+    'title',                # الاسم في رسائل السجل
+    'indicators',           # مؤشرات نصية في صفحات الكشف الأولى (أحرف صغيرة)
+    'layout_signature',     # دالة تفحص نص الصفحات الأولى عند غياب المؤشرات، أو None
+    'header_words',         # كلمات يجب أن تظهر جميعها في رأس الجدول، أو None
+    'classification_bank',  # قيمة البنك المُمررة للتصنيف
+    'extract_row',          # صف جدول PyMuPDF -> بيانات مستخرجة أو None
+    'parse_item',           # بيانات مستخرجة -> معاملة أو None (صف غير مقروء)
+    'parse_table_row',      # صف جدول pdfplumber -> معاملة أو None
+    'parse_text_parts',     # [التاريخ، الوصف، المبلغ] من سطر نصي -> معاملة، أو None إذا لم يُدعم
+    'table_header_words',   # كلمات تجعل الصف الأول من جدول PyMuPDF صف عناوين يُتخطى
+    'parse_page_text',      # أسطر نص صفحة PyMuPDF بلا جداول -> بيانات مستخرجة، أو None إذا لم يُدعم
+])
+
+# كلمات عناوين الجداول المشتركة بين كشوف الراجحي والأهلي
+COMMON_TABLE_HEADER_WORDS = ['تاريخ', 'date', 'مدين', 'دائن', 'الرصيد', 'تفاصيل']
+
+ALRAJHI_PARSER = BankParser(
+    name='الراجحي',
+    title='بنك الراجحي',
+    indicators=[
+        'alrajhibank.com', 'alrajhibank.com.sa',  # الموقع الرسمي
+        'alrajhi bank', 'مصرف الراجحي',
+        '920 003 344',  # رقم الهاتف المميز للراجحي
+        'الراجحي', 'alrajhi', 'al rajhi', 'al-rajhi',
+        'مصرف الراجحي', 'al rajhi bank', 'الراجحي المصرفية',
+        'alrajhi banking', 'مصرف الراجحي المصرفية',
+        'al rajhi banking', 'شركة الراجحي المصرفية',
+        'rajhi', 'الراجحى', 'al-rajhi bank',
+        'مصرف الراجحى', 'alrajhi bank',
+        # إضافة أرقام وأكواد خاصة بالراجحي
+        '80000', 'rjhi', 'sarb', 'الراجحي للاستثمار',
+        'al rajhi capital', 'الراجحي كابيتال'
+    ],
+    layout_signature=_alrajhi_layout_signature,
+    header_words=['تاريخ', 'تفاصيل', 'مدين', 'دائن', 'رصيد'],
+    classification_bank='الراجحي',
+    extract_row=_extract_alrajhi_row,
+    parse_item=extract_alrajhi_transaction_from_data,
+    parse_table_row=extract_alrajhi_transaction,
+    parse_text_parts=None,
+    table_header_words=COMMON_TABLE_HEADER_WORDS,
+    parse_page_text=_parse_sar_text_lines
+)
+
+AHLI_PARSER = BankParser(
+    name='الأهلي',
+    title='البنك الأهلي',
+    indicators=[
+        'الأهلي', 'الاهلي', 'ahli', 'al ahli', 'البنك الأهلي',
+        'البنك الاهلي', 'national bank', 'snb', 'الأهلي السعودي',
+        'البنك الأهلي السعودي', 'saudi national bank',
+        'البنك الاهلي التجاري', 'ncb', 'الاهلي التجاري'
+    ],
+    layout_signature=None,
+    header_words=['transaction', 'description'],
+    classification_bank=None,
+    extract_row=_extract_ahli_row,
+    parse_item=_parse_ahli_item,
+    parse_table_row=_parse_ahli_table_row,
+    parse_text_parts=_parse_text_parts,
+    table_header_words=COMMON_TABLE_HEADER_WORDS,
+    parse_page_text=_parse_sar_text_lines
+)
+
+# ترتيب السجل هو أولوية البنوك عند ظهور مؤشرات أكثر من بنك في نفس الصفحة
+BANK_PARSERS = [ALRAJHI_PARSER, AHLI_PARSER]
+
+# البنوك غير المعروفة تُعالج بتخطيط الأهلي (جدول: التاريخ | الوصف | المبلغ)
+DEFAULT_BANK_PARSER = AHLI_PARSER
+
+def _signature_alternation(indicators):
+    # الأطول أولاً حتى يظهر في السجل أكثر المؤشرات تحديداً
+    return '|'.join(re.escape(indicator) for indicator in sorted(set(indicators), key=len, reverse=True))
+
+# مؤشرات جميع البنوك في نمط واحد (مجموعة مسماة لكل بنك)؛ البحث الأمامي يفحص كل موقع
+# حتى لو تداخلت المؤشرات، فإضافة بنك لا تضيف مروراً جديداً على النص
+BANK_SIGNATURES_PATTERN = re.compile('(?=(?:' + '|'.join(
+    f'(?P<bank{parser_id}>{_signature_alternation(parser.indicators)})'
+    for parser_id, parser in enumerate(BANK_PARSERS)
+) + '))')
+
+def get_bank_parser(bank_type):
+    """المحلل المسجل لنوع البنك، أو المحلل الافتراضي"""
+    for parser in BANK_PARSERS:
+        if parser.name == bank_type:
+            return parser
+    return DEFAULT_BANK_PARSER
+
+class TransactionAccumulator:
+    """
+    تجميع معاملات الكشف أثناء قراءتها: العدادات والمجاميع والدخل والمصاريف المنتظرة للتصنيف
+    المصاريف المنتظرة تُصنف عند استدعاء classify_pending، إلا إذا كان المستدعي سيصنفها بنفسه مع ملفات أخرى
+    """
+    
+    def __init__(self, parser, pending_expenses, classify_expenses=True):
+        self.parser = parser
+        self.pending_expenses = pending_expenses
+        self.classify_expenses = classify_expenses
+        self.expense_details = defaultdict(list)
+        self.total_rows = 0
+        self.skipped_rows = 0
+        self.income_count = 0
+        self.expense_count = 0
+        self.total_income = 0.0
+        self.total_expense = 0.0
+        self.income_details = []
+    
+    @property
+    def total_count(self):
+        return self.income_count + self.expense_count
+    
+    def add(self, transaction):
+        """إضافة صف من الكشف (None = صف لم تتم قراءته بشكل صحيح)"""
+        self.total_rows += 1
+        if transaction is None:
+            self.skipped_rows += 1
+            return
+        
+        abs_amt = abs(transaction['amount'])
+        record = {
+            "date": transaction['date'],
+            "desc": transaction['desc'],
+            "amount": abs_amt,
+            "clean_desc": clean_transaction_desc(transaction['desc'])
+        }
+        
+        if transaction['type'] == 'income':
+            self.income_count += 1
+            self.total_income += abs_amt
+            self.income_details.append(record)
+        elif transaction['type'] == 'expense':
+            self.expense_count += 1
+            self.total_expense += abs_amt
+            self.pending_expenses.append((self.parser.classification_bank, record))
+    
+    def classify_pending(self):
+        """تصنيف المصاريف المنتظرة ثم تفريغها"""
+        if not self.classify_expenses or not self.pending_expenses:
+            return
+        classify_pending_expenses(self.pending_expenses, self.expense_details)
+        self.pending_expenses.clear()
+    
+    def result(self):
+        """نتيجة التحليل بالترتيب الذي تعيده analyze_transactions"""
+        return (self.total_rows, self.total_count, self.income_count, self.total_income,
+                self.expense_count, self.total_expense, self.skipped_rows,
+                self.income_details, self.expense_details)
+
+def analyze_transactions(pdf_path, pending_expenses=None):
+    """
+    تحليل العمليات من ملف PDF واحد - يدعم البنك الأهلي والراجحي
+    إذا مُررت pending_expenses تُضاف إليها المصاريف دون تصنيف ليصنفها المستدعي مع ملفات أخرى
+    """
+    # الملف يُفتح مرة واحدة ويُشارك بين كشف البنك والاستخراج ومسار العودة
+    with PDFDocument(pdf_path) as document:
+        return analyze_document(document, pending_expenses)
+
+def analyze_document(document, pending_expenses=None):
+    """
+    تحليل العمليات من مستند PDF مفتوح صفحة بصفحة (الاستخراج ثم الإحصاءات أثناء القراءة، ثم التصنيف)
+    الفهرس يُثبت للتحليل كله، فلا تُصنف صفحات الكشف الواحد بقاموسين إذا أُعيد تحميله أثناءه
+    """
+    with keyword_index_snapshot():
+        return _analyze_document(document, pending_expenses)
+
+def _analyze_document(document, pending_expenses):
+    # (البنك، المعاملة) يصنفها المستدعي بعد الاستخراج، أو تُصنف هنا بعد مسار PyMuPDF أو صفحة بصفحة في مسار العودة
+    defer_classification = pending_expenses is not None
+    if not defer_classification:
+        pending_expenses = []
+    pending_start = len(pending_expenses)
     
     app.logger.info("🔍 بدء تحليل كشف الحساب...")
     
-    # كشف نوع البنك
-    bank_type = detect_bank_type(pdf_path)
+    # كشف نوع البنك واختيار المحلل المسجل له
+    bank_type = detect_bank_type(document)
+    parser = get_bank_parser(bank_type)
     app.logger.info(f"🏦 نوع البنك المكتشف: {bank_type}")
+    
+    def new_accumulator():
+        return TransactionAccumulator(parser, pending_expenses, classify_expenses=not defer_classification)
+    
+    totals = new_accumulator()
 
     # محاولة استخدام PyMuPDF أولاً
     if PYMUPDF_AVAILABLE:
         app.logger.info("📘 استخدام PyMuPDF لاستخراج النصوص...")
-        extracted_data = extract_with_pymupdf(pdf_path)
+        # التصنيف (والتعلم) بعد اكتمال القراءة فقط: إذا فشلت في منتصفها يُعاد تحليل الصفوف بمسار العودة
+        # فلا تُتعلم مرتين؛ المصاريف المنتظرة نفس سجلات expense_details فلا تزيد الذاكرة
+        try:
+            for page_data in extract_with_pymupdf(document):
+                for item in page_data:
+                    totals.add(parser.parse_item(item))
+        except Exception as e:
+            app.logger.error(f"❌ خطأ في PyMuPDF: {str(e)}")
+            # تجاهل ما قُرئ قبل الخطأ والبدء من جديد بمسار العودة
+            del pending_expenses[pending_start:]
+            totals = new_accumulator()
         
-        if extracted_data:
-            for item in extracted_data:
-                total_rows += 1
-                
-                # معالجة حسب نوع البنك
-                if bank_type == 'الراجحي':
-                    # استخراج معاملة الراجحي
-                    transaction = extract_alrajhi_transaction_from_data(item)
-                    if transaction:
-                        if transaction['type'] == 'income':
-                            income_count += 1
-                            total_income += abs(transaction['amount'])
-                            income_details.append({
-                                "date": transaction['date'],
-                                "desc": transaction['desc'],
-                                "amount": abs(transaction['amount'])
-                            })
-                        elif transaction['type'] == 'expense':
-                            expense_count += 1
-                            abs_amt = abs(transaction['amount'])
-                            total_expense += abs_amt
-                            
-                            category = classify_expense_enhanced(transaction['desc'], bank=bank_type)
-                            expense_details[category].append({
-                                "date": transaction['date'],
-                                "desc": transaction['desc'],
-                                "amount": abs_amt
-                            })
-                    else:
-                        skipped_rows += 1
-                else:
-                    # معالجة البنك الأهلي (الطريقة الأصلية)
-                    try:
-                        amount = float(re.sub(r"[^\d\.-]", "", str(item['amount'])))
-                    except:
-                        skipped_rows += 1
-                        continue
-                    
-                    date = item['date']
-                    desc = item['desc']
-                    
-                    if not desc or desc == "[نص غير مقروء]":
-                        desc = "عملية مصرفية"
-                    
-                    if amount > 0:
-                        if any(x in desc.lower() for x in ["ضريبة", "رسوم", "vat", "fee", "charge"]):
-                            skipped_rows += 1
-                            continue
-                        income_count += 1
-                        total_income += amount
-                        income_details.append({"date": date, "desc": desc, "amount": amount})
-                    elif amount < 0:
-                        expense_count += 1
-                        abs_amt = abs(amount)
-                        total_expense += abs_amt
-                        
-                        category = classify_expense_enhanced(desc)
-                        expense_details[category].append({"date": date, "desc": desc, "amount": abs_amt})
-                    else:
-                        skipped_rows += 1
-            
-            total_count = income_count + expense_count
-            app.logger.info(f"✅ تم تحليل {total_count} عملية بنجاح!")
-            return total_rows, total_count, income_count, total_income, expense_count, total_expense, skipped_rows, income_details, expense_details
+        if totals.total_rows:
+            totals.classify_pending()
+            app.logger.info(f"✅ تم تحليل {totals.total_count} عملية بنجاح!")
+            return totals.result()
 
     # العودة إلى pdfplumber
     app.logger.info("📄 استخدام pdfplumber...")
     
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            tables = page.extract_tables({
-                "vertical_strategy": "lines",
-                "horizontal_strategy": "lines",
-                "snap_tolerance": 3,
-                "join_tolerance": 3,
-                "edge_min_length": 50,
-                "min_words_vertical": 0,
-                "min_words_horizontal": 0,
-                "text_tolerance": 3,
-                "text_x_tolerance": 3,
-                "text_y_tolerance": 3,
-                "intersection_tolerance": 3,
-            })
-            
-            if not tables:
-                text = page.extract_text()
-                if text:
-                    lines = text.split('\n')
-                    for line in lines:
-                        # معالجة للبنك الأهلي من النص
-                        if bank_type != 'الراجحي':
-                            parts = extract_transaction_from_line(line)
-                            if parts:
-                                total_rows += 1
-                                date = deep_fix_arabic_text(parts[0])
-                                desc = deep_fix_arabic_text(parts[1])
-                                try:
-                                    amount = float(parts[2])
-                                    process_transaction(date, desc, amount, income_details, expense_details)
-                                    if amount > 0:
-                                        income_count += 1
-                                        total_income += amount
-                                    else:
-                                        expense_count += 1
-                                        total_expense += abs(amount)
-                                except:
-                                    skipped_rows += 1
-                continue
-            
+    for page_num in range(document.page_count):
+        tables = document.page_tables(page_num, PLUMBER_TABLE_SETTINGS)
+        
+        if not tables:
+            # استخراج المعاملات من النص إذا كان البنك يدعم ذلك
+            if parser.parse_text_parts is not None:
+                for line in document.page_text(page_num).split('\n'):
+                    parts = extract_transaction_from_line(line)
+                    if parts:
+                        totals.add(parser.parse_text_parts(parts))
+        else:
             for table in tables:
                 # تخطي الصف الأول (العناوين)
                 for row in table[1:]:
-                    total_rows += 1
-                    
-                    if bank_type == 'الراجحي':
-                        # معالجة خاصة لبنك الراجحي
-                        transaction = extract_alrajhi_transaction(row)
-                        if transaction:
-                            if transaction['type'] == 'income':
-                                income_count += 1
-                                total_income += abs(transaction['amount'])
-                                income_details.append({
-                                    "date": transaction['date'],
-                                    "desc": transaction['desc'],
-                                    "amount": abs(transaction['amount'])
-                                })
-                            elif transaction['type'] == 'expense':
-                                expense_count += 1
-                                abs_amt = abs(transaction['amount'])
-                                total_expense += abs_amt
-                                
-                                category = classify_expense_enhanced(transaction['desc'], bank=bank_type)
-                                expense_details[category].append({
-                                    "date": transaction['date'],
-                                    "desc": transaction['desc'],
-                                    "amount": abs_amt
-                                })
-                        else:
-                            skipped_rows += 1
-                    
-                    else:
-                        # معالجة البنك الأهلي (الطريقة الأصلية)
-                        if len(row) < 3 or not row[2]:
-                            skipped_rows += 1
-                            continue
-                        
-                        date_raw = extract_text_properly(row[0])
-                        desc_raw = extract_text_properly(row[1])
-                        amount_raw = extract_text_properly(row[2])
-                        
-                        date = deep_fix_arabic_text(date_raw)
-                        desc = deep_fix_arabic_text(desc_raw)
-                        
-                        if not date or date == "[نص غير مقروء]":
-                            date = datetime.now().strftime("%d/%m/%Y")
-                        
-                        if not desc or desc == "[نص غير مقروء]":
-                            desc = "عملية مصرفية"
-                        
-                        try:
-                            amount = float(re.sub(r"[^\d\.-]", "", amount_raw))
-                        except:
-                            skipped_rows += 1
-                            continue
-
-                        if amount > 0:
-                            if any(x in desc.lower() for x in ["ضريبة", "رسوم", "vat", "fee", "charge"]):
-                                skipped_rows += 1
-                                continue
-                            income_count += 1
-                            total_income += amount
-                            income_details.append({"date": date, "desc": desc, "amount": amount})
-                        elif amount < 0:
-                            expense_count += 1
-                            abs_amt = abs(amount)
-                            total_expense += abs_amt
-                            
-                            category = classify_expense_enhanced(desc)
-                            expense_details[category].append({"date": date, "desc": desc, "amount": abs_amt})
-                        else:
-                            skipped_rows += 1
-
-    total_count = income_count + expense_count
+                    totals.add(parser.parse_table_row(row))
+        
+        document.release_page(page_num)
+        totals.classify_pending()
     
-    if skipped_rows > total_rows * 0.3:
-        app.logger.warning(f"⚠️ تحذير: {skipped_rows} من {total_rows} صف لم يتم قراءتها بشكل صحيح")
+    if totals.skipped_rows > totals.total_rows * 0.3:
+        app.logger.warning(f"⚠️ تحذير: {totals.skipped_rows} من {totals.total_rows} صف لم يتم قراءتها بشكل صحيح")
         app.logger.info("💡 نصيحة: جرّب تثبيت PyMuPDF للحصول على نتائج أفضل: pip install PyMuPDF")
     
     app.logger.info(f"🏦 تم تحليل كشف حساب {bank_type}")
-    app.logger.info(f"📊 إجمالي العمليات: {total_count}")
-    app.logger.info(f"📈 الدخل: {income_count} عملية - {total_income:,.2f} ريال")
-    app.logger.info(f"📉 المصاريف: {expense_count} عملية - {total_expense:,.2f} ريال")
+    app.logger.info(f"📊 إجمالي العمليات: {totals.total_count}")
+    app.logger.info(f"📈 الدخل: {totals.income_count} عملية - {totals.total_income:,.2f} ريال")
+    app.logger.info(f"📉 المصاريف: {totals.expense_count} عملية - {totals.total_expense:,.2f} ريال")
     
-    return total_rows, total_count, income_count, total_income, expense_count, total_expense, skipped_rows, income_details, expense_details
+    return totals.result()
 
 def analyze_multiple_transactions(pdf_files):
     """تحليل العمليات من ملفات PDF متعددة"""
@@ -1433,6 +1689,7 @@ def analyze_multiple_transactions(pdf_files):
     
     combined_income_details = []
     combined_expense_details = defaultdict(list)
+    combined_pending_expenses = []  # مصاريف جميع الملفات تُصنف معاً بعد الاستخراج
     
     app.logger.info(f"\n📊 بدء تحليل {len(pdf_files)} ملف(ات)...")
     
@@ -1440,8 +1697,9 @@ def analyze_multiple_transactions(pdf_files):
         app.logger.info(f"\n🔍 جاري تحليل الملف {i}: {os.path.basename(pdf_path)}")
         
         try:
+            file_pending_expenses = []
             (rows, ops, inc_count, inc_sum, exp_count, exp_sum, skipped, 
-             income_details, expense_details) = analyze_transactions(pdf_path)
+             income_details, expense_details) = analyze_transactions(pdf_path, file_pending_expenses)
             
             total_income_count += inc_count
             total_expense_count += exp_count
@@ -1454,10 +1712,9 @@ def analyze_multiple_transactions(pdf_files):
                 income_item['account_file'] = os.path.basename(pdf_path)
                 combined_income_details.append(income_item)
             
-            for category, transactions in expense_details.items():
-                for transaction in transactions:
-                    transaction['account_file'] = os.path.basename(pdf_path)
-                    combined_expense_details[category].append(transaction)
+            for bank, transaction in file_pending_expenses:
+                transaction['account_file'] = os.path.basename(pdf_path)
+                combined_pending_expenses.append((bank, transaction))
             
             app.logger.info(f"✅ تم تحليل الملف {i} بنجاح")
             app.logger.info(f"   📈 دخل: {inc_count} عملية - {inc_sum:,.2f} ريال")
@@ -1467,6 +1724,9 @@ def analyze_multiple_transactions(pdf_files):
             app.logger.error(f"❌ خطأ في تحليل الملف {i}: {str(e)}")
             continue
     
+    # تصنيف مصاريف جميع الملفات في دفعة واحدة (تتوزع على عدة عمليات إذا كانت كبيرة)
+    classify_pending_expenses(combined_pending_expenses, combined_expense_details)
+    
     total_operations = total_income_count + total_expense_count
     
     app.logger.info(f"\n🎯 انتهى تحليل جميع الملفات!")
@@ -1723,14 +1983,6 @@ def analyze_single_file(file_path):
            'change_percentage': ((final_balance - initial_balance) / initial_balance * 100) if initial_balance > 0 else 0
        }
        
-       # تنظيف أوصاف المعاملات
-       for category, transactions in expense_details.items():
-           for trans in transactions:
-               trans['clean_desc'] = clean_transaction_desc(trans['desc'])
-       
-       for trans in income_details:
-           trans['clean_desc'] = clean_transaction_desc(trans['desc'])
-       
        # حساب إحصائيات التصنيفات بالنظام الجديد
        category_stats = get_category_statistics(expense_details)
        
@@ -1792,14 +2044,6 @@ def analyze_multiple_files(file_paths):
            'change_percentage': ((final_balance - initial_balance) / initial_balance * 100) if initial_balance > 0 else 0
        }
        
-       # تنظيف أوصاف المعاملات
-       for category, transactions in expense_details.items():
-           for trans in transactions:
-               trans['clean_desc'] = clean_transaction_desc(trans['desc'])
-       
-       for trans in income_details:
-           trans['clean_desc'] = clean_transaction_desc(trans['desc'])
-       
        # حساب إحصائيات التصنيفات بالنظام الجديد
        category_stats = get_category_statistics(expense_details)
        
@@ -1957,8 +2201,9 @@ def test_classification():
 def get_categories():
    """الحصول على قائمة التصنيفات المتاحة"""
    try:
+       # القاموس النشط (قد يُعاد تحميله من ملف خارجي أثناء التشغيل)
        categories = []
-       for main_category, subcategories in EXPENSE_CATEGORIES.items():
+       for main_category, subcategories in get_keyword_index().categories.items():
            category_info = {
                'name': main_category,
                'subcategories': list(subcategories.keys()),
@@ -1985,14 +2230,8 @@ def health_check():
    try:
        cleanup_expired_links()
        
-       # حساب إحصائيات النظام
-       total_keywords = 0
-       total_subcategories = 0
-       
-       for main_cat, subcats in EXPENSE_CATEGORIES.items():
-           total_subcategories += len(subcats)
-           for keywords in subcats.values():
-               total_keywords += len(keywords)
+       # إحصائيات النظام من فهرس الكلمات المفتاحية المشترك
+       keyword_index = get_keyword_index()
        
        return jsonify({
            'status': 'healthy',
@@ -2000,9 +2239,10 @@ def health_check():
            'active_links': len(active_links),
            'classification_method': 'two-level',
            'classification_version': '2.0',
-           'main_categories': len(EXPENSE_CATEGORIES),
-           'total_subcategories': total_subcategories,
-           'total_keywords': total_keywords,
+           'main_categories': keyword_index.main_categories,
+           'total_subcategories': keyword_index.total_subcategories,
+           'total_keywords': keyword_index.total_keywords,
+           'ruleset_version': get_ruleset_version(),
            'supported_banks': ['البنك الأهلي', 'بنك الراجحي'],
            'version': '4.0.0'  # نسخة جديدة للنظام المحدث
        })
@@ -2026,20 +2266,14 @@ def download_sample():
 def get_stats():
    """الحصول على إحصائيات النظام"""
    try:
-       total_keywords = 0
-       total_subcategories = 0
-       
-       for main_cat, subcats in EXPENSE_CATEGORIES.items():
-           total_subcategories += len(subcats)
-           for keywords in subcats.values():
-               total_keywords += len(keywords)
+       keyword_index = get_keyword_index()
        
        stats = {
            'classification_version': '2.0',
            'classification_method': 'التصنيف الثنائي (رئيسي وفرعي)',
-           'total_main_categories': len(EXPENSE_CATEGORIES),
-           'total_subcategories': total_subcategories,
-           'total_keywords': total_keywords,
+           'total_main_categories': keyword_index.main_categories,
+           'total_subcategories': keyword_index.total_subcategories,
+           'total_keywords': keyword_index.total_keywords,
            'active_links': len(active_links),
            'classification_accuracy': '97%',  # تقديري
            'supported_banks': ['البنك الأهلي', 'بنك الراجحي', 'سامبا', 'الرياض', 'ساب', 'الإنماء'],
@@ -2131,13 +2365,13 @@ if __name__ == '__main__':
        print("\n📊 إحصائيات التصنيفات:")
    
    try:
-       total_subcategories = sum(len(subs) for subs in EXPENSE_CATEGORIES.values())
+       keyword_index = get_keyword_index()
        if not use_ngrok:
-           print(f"   • {len(EXPENSE_CATEGORIES)} تصنيف رئيسي")
-           print(f"   • {total_subcategories} تصنيف فرعي")
+           print(f"   • {keyword_index.main_categories} تصنيف رئيسي")
+           print(f"   • {keyword_index.total_subcategories} تصنيف فرعي")
            
            print("\n📋 التصنيفات الرئيسية:")
-           for i, category in enumerate(EXPENSE_CATEGORIES.keys(), 1):
+           for i, category in enumerate(keyword_index.categories.keys(), 1):
                print(f"   {i}. {category}")
            
            print(f"\n✅ تم تحميل النظام بنجاح!")
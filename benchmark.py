@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+قياس أداء مراحل التصنيف على نصوص كشوف حساب حقيقية
+
+الاستخدام:
+    python benchmark.py            # جميع القياسات
+    python benchmark.py normalize  # تطبيع النص فقط
+    python benchmark.py candidates # حجم وزمن إيجاد الكلمات المرشحة
+"""
+
+import sys
+import time
+import unicodedata
+from collections import Counter
+
+import expense_categories as ec
+
+# نصوص مأخوذة من كشوف الراجحي (بأشكال العرض العربية كما يستخرجها PDF)
+STATEMENT_SAMPLES = [
+    "KHALED ﺑﺎﺳﻤﺢ ﻟﻠﺘﺴﻮﻳﻖ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊABDULLAH CITY: JEDH682016JED JEDDAH MADA***8768 VAT CHRG: 0. 00 0. 00",
+    "BEN ID: ﺗﺤﻮﻳﻞ ﺩﺍﺧﻠﻲ ﺻﺎﺩﺭ ﺗﺤﻮﻳﻞ ﺍﻟﻰ ﺍﻻﻫﻞ ﻭﺍﻻﺻﺪﻗﺎﺀ",
+    "ﺧﺼﻢ ﻗﺴﻂ ﺗﻤﻮﻳﻞ ﺗﺄﺟﻴﺮﻱ",
+    "STC Pay CITY: 0000682016SAM MCC- 6540ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖ Riyadh MADA ***1502 VAT CHRG: 0. 00 0. 00",
+    "ﻣﺪﻓﻮﻋﺎﺕ ﺳﺪﺍﺩ 002-ﺍﻟﺸﺮﻛﺔ ﺍﻟﺴﻌﻮﺩﻳﺔ ﻟﻠﻜﻬﺮﺑﺎﺀ-",
+    "ﻣﺪﻓﻮﻋﺎﺕ ﺳﺪﺍﺩ 093-ﺍﻟﻤﺨﺎﻟﻔﺎﺕ ﺍﻟﻤﺮﻭﺭﻳﺔ-",
+    "F. S. T. Co - Aﺷﺮﻛﺔ ﺍﻣﺪﺍﺩ ﺍﻷﻁ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊCITY: 0000682016SAM RAS TANOURAH MADA***1502 VAT CHRG: 0. 00 0. 00",
+    "ﺗﺤﻮﻳﻞ ﺩﺍﺧﻠﻲ ﺻﺎﺩﺭ NCBK82824148ALPO / ﺭﺳﻮﻡ ﺣﻮﺍﻟﺔ",
+    "BRIGHT STAGEﻣﺆﺳﺴﺔ ﺍﻟﻤﻨﺼﺔ ﺍﻝ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊEV CITY: 0000682016SAM KHOBAR MADA***1502 VAT CHRG: 0. 00 0. 00",
+    "CITY: Digital Channel ﺭﺳﻮﻡ ﺗﺤﻮﻳﻞ",
+    "CITY: Digital Channel ﺿﺮﻳﺒﺔ ﺍﻟﻘﻴﻤﺔ ﺍﻟﻤﻀﺎﻓﺔ",
+    "CARD: 430259 PAYMENT ﻣﺪﻓﻮﻋﺎﺕ ﺑﻄﺎﻗﺔ ﺇﺋﺘﻤﺎﻧﻴﺔ",
+    "Musaned Contrac ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖCITY: 0000682016SAM Riyadh MADA ***1502VAT CHRG: 0. 00 0. 00",
+    "Coarse Grind ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊ - ﻣﺪﻯ ﺃﺛﻴﺮ ﻛﻮﺭﺱ ﺟﺮﺍﻳﻨﺪCITY: 0000682016SAM JEDDAH MADA ***8768VAT CHRG: 0. 00 0. 00",
+    "AYA MALL BINDAWﺑﻦ ﺩﺍﻭﻭﺩ ﺁﻳﺎ ﻣﻮ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊCITY: 0000682016SAM JEDDAH MADA ***8768VAT CHRG: 0. 00 0. 00",
+    "‏مدفوعات سداد ٠٠٢ - الشركة السعودية للكهرباء‎",
+]
+
+
+def _legacy_normalize_arabic_text(text: str) -> str:
+    """التطبيع السابق (حرفاً بحرف) كمرجع للمقارنة"""
+    if not text:
+        return ""
+
+    text = unicodedata.normalize('NFKC', text)
+    text = ''.join(char for char in text if unicodedata.category(char)[0] != 'C')
+
+    text = text.replace('‏', '').replace('‎', '')
+    text = text.replace('‪', '').replace('‫', '').replace('‬', '')
+
+    arabic_to_english = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
+    text = text.translate(arabic_to_english)
+
+    replacements = {
+        'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
+        'ة': 'ه',
+        'ى': 'ي',
+        'ؤ': 'و',
+        'ئ': 'ي'
+    }
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+
+    return text
+
+
+def _time_per_call(func, samples, rounds):
+    """متوسط زمن الاستدعاء الواحد بالميكروثانية"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for sample in samples:
+            func(sample)
+    elapsed = time.perf_counter() - start
+    return elapsed / (rounds * len(samples)) * 1e6
+
+
+def bench_normalize(rounds=2000):
+    """مقارنة التطبيع السابق بالتطبيع الحالي (بدون ذاكرة وبها)"""
+    for sample in STATEMENT_SAMPLES:
+        assert ec.normalize_arabic_text(sample) == _legacy_normalize_arabic_text(sample), sample
+
+    uncached = ec._normalize_arabic_text.__wrapped__
+
+    legacy = _time_per_call(_legacy_normalize_arabic_text, STATEMENT_SAMPLES, rounds)
+    current = _time_per_call(uncached, STATEMENT_SAMPLES, rounds)
+
+    ec._normalize_arabic_text.cache_clear()
+    cached = _time_per_call(ec.normalize_arabic_text, STATEMENT_SAMPLES, rounds)
+
+    print("تطبيع النص العربي (ميكروثانية لكل وصف):")
+    print(f"  السابق:            {legacy:8.2f}")
+    print(f"  الحالي بدون ذاكرة: {current:8.2f}  (x{legacy / current:.1f})")
+    print(f"  الحالي مع الذاكرة: {cached:8.2f}  (x{legacy / cached:.1f})")
+
+
+def _prepare(description):
+    """نفس تحضير النص في classify_transaction قبل البحث عن الكلمات المرشحة"""
+    desc_normalized = ec.normalize_arabic_text(description)
+    desc_clean = ec.clean_for_classification(desc_normalized, preserve_keywords=True)
+    if not desc_clean.strip():
+        desc_clean = desc_normalized
+    desc_lower = desc_clean.lower()
+    return desc_lower, desc_lower.replace(" ", "")
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bench_candidates(rounds=200, min_overlap=0.5):
+    """
+    حجم مجموعة الكلمات المرشحة وزمن إيجادها: الآلة الحالية مقابل فهرس ثلاثيات أحرف
+    (الكلمة مرشحة إذا شاركت الوصف في نسبة min_overlap من ثلاثياتها على الأقل)
+    """
+    index = ec.get_keyword_index()
+
+    postings = {}
+    trigram_counts = []
+    for entry_id, entry in enumerate(index.entries):
+        grams = _trigrams(entry.text) | _trigrams(entry.no_spaces)
+        trigram_counts.append(len(grams))
+        for gram in grams:
+            postings.setdefault(gram, []).append(entry_id)
+
+    prepared = [_prepare(sample) for sample in STATEMENT_SAMPLES]
+
+    def automaton_candidates(desc_lower, desc_no_spaces):
+        hits = {entry_id for _, entry_id in index.automaton.iter_matches(desc_lower)}
+        hits.update(entry_id for _, entry_id in index.glued_automaton.iter_matches(desc_no_spaces))
+        return hits
+
+    def trigram_candidates(desc_lower, desc_no_spaces):
+        shared = Counter()
+        for gram in _trigrams(desc_lower) | _trigrams(desc_no_spaces):
+            shared.update(postings.get(gram, ()))
+        return {entry_id for entry_id, count in shared.items()
+                if count >= trigram_counts[entry_id] * min_overlap}
+
+    def trigram_verified(desc_lower, desc_no_spaces):
+        # الثلاثيات تصفية تقريبية فقط، ويلزم التحقق من وجود الكلمة فعلاً قبل التقييم
+        return {entry_id for entry_id in trigram_candidates(desc_lower, desc_no_spaces)
+                if index.entries[entry_id].text in desc_lower
+                or index.entries[entry_id].no_spaces in desc_no_spaces}
+
+    automaton_sizes = [len(automaton_candidates(*texts)) for texts in prepared]
+    trigram_sizes = [len(trigram_candidates(*texts)) for texts in prepared]
+    # الكلمة الملتصقة بغيرها يجدها مطابق الآلة دون مسافات، وقد تشارك أقل من min_overlap من ثلاثياتها
+    # فتفوتها التصفية؛ لذلك لا تصلح الثلاثيات بديلاً عن الآلة
+    missed = sum(len(automaton_candidates(*texts) - trigram_verified(*texts)) for texts in prepared)
+
+    automaton_time = _time_per_call(lambda texts: automaton_candidates(*texts), prepared, rounds)
+    trigram_time = _time_per_call(lambda texts: trigram_verified(*texts), prepared, rounds)
+
+    print(f"الكلمات المرشحة ({len(index.entries)} كلمة موحدة، {len(prepared)} وصف):")
+    print(f"  الآلة (تطابقات فعلية):        متوسط {sum(automaton_sizes) / len(prepared):6.1f}"
+          f"  أقصى {max(automaton_sizes):4d}  {automaton_time:8.1f} ميكروثانية")
+    print(f"  ثلاثيات الأحرف (>= {min_overlap:.0%}):     متوسط {sum(trigram_sizes) / len(prepared):6.1f}"
+          f"  أقصى {max(trigram_sizes):4d}  {trigram_time:8.1f} ميكروثانية (مع التحقق)")
+    print(f"  تطابقات فاتت الثلاثيات: {missed}")
+
+
+BENCHMARKS = {
+    'normalize': bench_normalize,
+    'candidates': bench_candidates,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
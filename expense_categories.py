@@ -5,9 +5,21 @@
 """
 
 import re
+import os
+import json
+import time
+import tempfile
+import threading
+import hashlib
+import logging
 import unicodedata
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+from contextlib import contextmanager
 from typing import Tuple, Optional, List, Dict, Set
 
+logger = logging.getLogger(__name__)
+
 # قاموس التصنيفات الموسع والشامل
 EXPENSE_CATEGORIES = {
     "🔄 تحويلات مالية": {
@@ -1705,60 +1717,517 @@ IGNORE_WORDS = [
 ]
 
 
-def normalize_arabic_text(text: str) -> str:
+class _ControlCharsTable(dict):
     """
-    تطبيع النص العربي ومعالجة المشاكل الشائعة
+    جدول str.translate يحذف أحرف يونيكود من الفئة C (تحكم، تنسيق، غير معرّفة...)
+    يُملأ عند أول ظهور لكل حرف بدل فحص جميع أحرف يونيكود عند الاستيراد
     """
-    if not text:
-        return ""
     
-    # تطبيع Unicode
+    def __missing__(self, code_point):
+        value = None if unicodedata.category(chr(code_point))[0] == 'C' else code_point
+        self[code_point] = value
+        return value
+
+
+# إزالة علامات التحكم غير المرئية (ومنها علامات الاتجاه)
+_CONTROL_CHARS_TABLE = _ControlCharsTable()
+
+# جدول تحويل واحد: الأرقام العربية إلى إنجليزية وتوحيد الحروف العربية المتشابهة
+_NORMALIZE_TABLE = str.maketrans({
+    **{arabic: english for arabic, english in zip('٠١٢٣٤٥٦٧٨٩', '0123456789')},
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ؤ': 'و',
+    'ئ': 'ي'
+})
+
+
+@lru_cache(maxsize=50000)
+def _normalize_arabic_text(text: str) -> str:
     text = unicodedata.normalize('NFKC', text)
     
-    # إزالة علامات التحكم غير المرئية
-    text = ''.join(char for char in text if unicodedata.category(char)[0] != 'C')
-    
-    # إزالة علامات الاتجاه
-    text = text.replace('\u200f', '').replace('\u200e', '')
-    text = text.replace('\u202a', '').replace('\u202b', '').replace('\u202c', '')
-    
-    # تحويل الأرقام العربية إلى إنجليزية للتوحيد
-    arabic_numerals = '٠١٢٣٤٥٦٧٨٩'
-    english_numerals = '0123456789'
-    trans_table = str.maketrans(arabic_numerals, english_numerals)
-    text = text.translate(trans_table)
-    
-    # توحيد الحروف العربية المتشابهة
-    replacements = {
-        'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
-        'ة': 'ه',
-        'ى': 'ي',
-        'ؤ': 'و',
-        'ئ': 'ي'
-    }
+    if not text.isprintable():
+        text = text.translate(_CONTROL_CHARS_TABLE)
     
-    for old, new in replacements.items():
-        text = text.replace(old, new)
+    return text.translate(_NORMALIZE_TABLE)
+
+
+def normalize_arabic_text(text: str) -> str:
+    """
+    تطبيع النص العربي ومعالجة المشاكل الشائعة
+    """
+    if not text:
+        return ""
     
-    return text
+    return _normalize_arabic_text(text)
+
+
+# ==================== محرك مطابقة الكلمات المفتاحية ====================
+
+class KeywordAutomaton:
+    """
+    آلة Aho-Corasick للعثور على جميع الكلمات المفتاحية في مرور واحد على النص
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+    def add(self, pattern: str, value) -> None:
+        """إضافة نمط مع القيمة التي تُعاد عند العثور عليه"""
+        if not pattern:
+            return
+
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+
+        self._output[state].append((len(pattern), value))
+
+    def build(self) -> None:
+        """حساب روابط الفشل بعد إضافة جميع الأنماط"""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+
+                # توريث مخرجات حالة الفشل لتجنب تتبع السلسلة وقت البحث
+                inherited = self._output[self._fail[next_state]]
+                if inherited:
+                    self._output[next_state] = self._output[next_state] + inherited
+
+    def iter_matches(self, text: str):
+        """
+        إرجاع (موقع البداية، القيمة) لكل تطابق في النص بما فيها التطابقات المتداخلة
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for length, value in output[state]:
+                yield position - length + 1, value
+
+
+# كلمات تحصل على نقاط إضافية عند تطابقها
+SPECIFIC_KEYWORDS = {
+    "khaled ﺑﺎﺳﻤﺢ", "f. s. t. co", "musaned", "coarse grind",
+    "aya mall bindaw", "bright stage", "digital channel", "ben id",
+    "apple pay - دولية", "خدمات المقيمين", "رسوم ديجيتال",
+    "مدفوعات بطاقة إئتمانية", "card: 430259"
+}
+
+
+def _keyword_bonus(keyword_lower: str) -> int:
+    """النقاط الإضافية الثابتة للكلمة (الكلمات الخاصة والطويلة)"""
+    bonus = 20 if keyword_lower in SPECIFIC_KEYWORDS else 0
+
+    if len(keyword_lower) >= 10:
+        bonus += 10
+    elif len(keyword_lower) >= 6:
+        bonus += 5
+
+    return bonus
+
+
+# أصل الكلمة المفتاحية في القاموس: ترتيبها وتصنيفها وهل غيّرها التطبيع
+KeywordOrigin = namedtuple('KeywordOrigin', [
+    'order', 'main_category', 'sub_category', 'keyword', 'normalized', 'bonus'
+])
+
+# كلمة مفتاحية بشكلها الموحد (مطبعة مرة واحدة) مع جميع أصولها في القاموس
+CanonicalKeyword = namedtuple('CanonicalKeyword', ['text', 'no_spaces', 'origins'])
+
+
+class KeywordIndex:
+    """
+    فهرس مجمّع لقاموس التصنيفات يُبنى مرة واحدة ويحمل بصمة إصدار القاموس
+    """
+
+    def __init__(self, categories: Dict[str, Dict[str, List[str]]], supersedes=None):
+        # الفهرس والقاموس الذي بُني منه لقطة واحدة؛ supersedes هو القاموس الذي حل محله عند install_categories
+        self.categories = categories
+        self.supersedes = supersedes
+        self.version = categories_version(categories)
+        self.content_hash = _categories_content_hash(categories)
+
+        self.main_categories = len(categories)
+        self.total_subcategories = 0
+        self.total_keywords = 0
+
+        self.keywords = set()
+        self.entries = []
+        self._entry_ids = {}
+
+        for main_category, subcategories in categories.items():
+            self.total_subcategories += len(subcategories)
+
+            for sub_category, keywords in subcategories.items():
+                for keyword in keywords:
+                    self._add_keyword(main_category, sub_category, keyword)
+                    self.total_keywords += 1
+
+        self.keywords = frozenset(self.keywords)
+
+        # كل شكل موحد يُضاف مرة واحدة مهما تكرر في القاموس
+        self.automaton = KeywordAutomaton()
+        self.glued_automaton = KeywordAutomaton()
+        for entry_id, entry in enumerate(self.entries):
+            self.automaton.add(entry.text, entry_id)
+            self.glued_automaton.add(entry.no_spaces, entry_id)
+        self.automaton.build()
+        self.glued_automaton.build()
+
+        # آلة لمعرفة الكلمات المحمية الموجودة في النص أثناء التنظيف
+        self.keywords_automaton = KeywordAutomaton()
+        for keyword in self.keywords:
+            self.keywords_automaton.add(keyword, keyword)
+        self.keywords_automaton.build()
+
+    def keywords_in(self, text_lower: str) -> Set[str]:
+        """الكلمات المحمية الموجودة في النص (بأحرف صغيرة)"""
+        return {keyword for _, keyword in self.keywords_automaton.iter_matches(text_lower)}
+
+    def _add_keyword(self, main_category: str, sub_category: str, keyword: str) -> None:
+        keyword_lower = keyword.lower()
+        canonical = normalize_arabic_text(keyword_lower)
+
+        # مجموعة الكلمات المحمية: الشكل الأصلي والمطبع
+        self.keywords.add(keyword_lower)
+        self.keywords.add(canonical)
+
+        # تخطي إذا كانت الكلمة قصيرة جداً
+        if len(keyword_lower) < 3:
+            return
+
+        entry_id = self._entry_ids.get(canonical)
+        if entry_id is None:
+            entry_id = self._entry_ids[canonical] = len(self.entries)
+            self.entries.append(CanonicalKeyword(canonical, canonical.replace(" ", ""), []))
+
+        self.entries[entry_id].origins.append(KeywordOrigin(
+            self.total_keywords, main_category, sub_category, keyword,
+            canonical != keyword_lower, _keyword_bonus(keyword_lower)
+        ))
+
+
+def categories_version(categories: Dict[str, Dict[str, List[str]]]) -> str:
+    """بصمة (hash) لمحتوى قاموس التصنيفات بترتيبه"""
+    payload = json.dumps(categories, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+def _categories_content_hash(categories: Dict[str, Dict[str, List[str]]]) -> int:
+    """فحص لمحتوى القاموس داخل العملية (أسرع بكثير من categories_version لأن بصمات النصوص محفوظة)"""
+    return hash(tuple(
+        (main_category, sub_category, tuple(keywords))
+        for main_category, subcategories in categories.items()
+        for sub_category, keywords in subcategories.items()
+    ))
+
+
+_keyword_index = None
+
+# فهرس مثبت لكل خيط أثناء عملية تصنيف جارية (انظر keyword_index_snapshot)
+_pinned_index = threading.local()
+
+
+def get_keyword_index() -> KeywordIndex:
+    """
+    الحصول على فهرس الكلمات المفتاحية المشترك، مع إعادة بنائه فقط إذا استُبدل القاموس
+    يُستدعى لكل وصف، فيقارن هوية القاموس فقط؛ التعديل في مكانه يكتشفه refresh_keyword_index
+    """
+    global _keyword_index
+
+    index = getattr(_pinned_index, 'index', None)
+    if index is not None:
+        return index
+
+    if _categories_watcher is not None:
+        _categories_watcher.ensure_running()
+
+    # القاموس قبل الفهرس: install_categories ينشر الفهرس قبل القاموس، فمن يرى القاموس الجديد يرى فهرسه
+    # ومن يرى القاموس القديم مع الفهرس الجديد يعرفه من supersedes ولا يعيد البناء
+    categories = EXPENSE_CATEGORIES
+    index = _keyword_index
+    if index is None or (categories is not index.categories and categories is not index.supersedes):
+        index = _keyword_index = KeywordIndex(categories)
+
+    return index
+
+
+@contextmanager
+def keyword_index_snapshot():
+    """
+    تثبيت الفهرس الحالي للخيط طوال عملية التصنيف، فلا يؤثر عليها استبدال القاموس أثناءها
+    """
+    previous = getattr(_pinned_index, 'index', None)
+    if previous is None:
+        _pinned_index.index = refresh_keyword_index()
+        refresh_merchant_matcher()
+        # إصدار القواعد يُحسب مرة واحدة للعملية كلها (انظر get_ruleset_version)
+        _pinned_index.version = None
+    try:
+        yield _pinned_index.index
+    finally:
+        _pinned_index.index = previous
+
+
+def refresh_keyword_index() -> KeywordIndex:
+    """
+    مثل get_keyword_index مع فحص محتوى القاموس نفسه، لاكتشاف تعديله في مكانه
+    يُستدعى مرة في بداية كل عملية تصنيف (keyword_index_snapshot) وعند حساب إصدار القواعد
+    """
+    global _keyword_index
+
+    index = get_keyword_index()
+    if getattr(_pinned_index, 'index', None) is None and index.content_hash != _categories_content_hash(index.categories):
+        index = _keyword_index = KeywordIndex(index.categories, index.supersedes)
+
+    return index
 
 
 def get_all_keywords() -> Set[str]:
     """
     استخراج جميع الكلمات المفتاحية من قاموس التصنيفات
     """
-    all_keywords = set()
-    
-    for main_category, subcategories in EXPENSE_CATEGORIES.items():
-        for sub_category, keywords in subcategories.items():
-            for keyword in keywords:
-                all_keywords.add(keyword.lower())
-                # إضافة النسخة المطبعة أيضاً
-                normalized = normalize_arabic_text(keyword.lower())
-                if normalized != keyword.lower():
-                    all_keywords.add(normalized)
-    
-    return all_keywords
+    return get_keyword_index().keywords
+
+
+# ==================== أدوات الملفات والخيوط الخلفية ====================
+
+def _atomic_write(path: str, payload: str, prefix: str) -> None:
+    """كتابة ذرية: ملف مؤقت في نفس المجلد ثم استبدال الملف الأصلي"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=prefix, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            os.chmod(temp_path, 0o644)
+            f.write(payload)
+        os.replace(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class _BackgroundThread:
+    """خيط خلفي (daemon) يُشغل عند الحاجة، ويُعاد تشغيله في العملية الفرعية بعد fork"""
+
+    def __init__(self, target, name: str):
+        self._target = target
+        self._name = name
+        self._thread = None
+        self._pid = None
+
+    def ensure_running(self) -> None:
+        # الخيوط لا تنتقل مع fork، لذا نتحقق من رقم العملية أيضاً
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._target, name=self._name, daemon=True)
+        self._thread.start()
+
+
+# ==================== تحميل القاموس من ملف خارجي ====================
+
+def load_categories_file(path: str) -> Dict[str, Dict[str, List[str]]]:
+    """
+    قراءة قاموس التصنيفات من ملف JSON بنفس بنية EXPENSE_CATEGORIES والتحقق منها
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        categories = json.load(f)
+
+    valid = isinstance(categories, dict) and all(
+        isinstance(subcategories, dict) and all(
+            isinstance(keywords, list) and all(isinstance(keyword, str) for keyword in keywords)
+            for keywords in subcategories.values()
+        )
+        for subcategories in categories.values()
+    )
+    if not valid or not categories:
+        raise ValueError(f"بنية ملف التصنيفات غير صحيحة: {path}")
+
+    return categories
+
+
+def save_categories_file(path: str, categories: Optional[Dict[str, Dict[str, List[str]]]] = None) -> None:
+    """
+    كتابة القاموس (الحالي افتراضياً) إلى ملف JSON لتعديله خارج الكود
+    """
+    if categories is None:
+        categories = get_keyword_index().categories
+
+    _atomic_write(path, json.dumps(categories, ensure_ascii=False, indent=2), '.categories-')
+
+
+_install_lock = threading.Lock()
+
+# الذاكرة الدائمة للتصنيف (تُنشأ في القسم 7)؛ تُحذف منها نتائج الإصدارات الأخرى عند استبدال القاموس
+_persistent_cache = None
+
+
+def install_categories(categories: Dict[str, Dict[str, List[str]]]) -> KeywordIndex:
+    """
+    بناء فهرس للقاموس الجديد بالكامل ثم استبداله بالحالي،
+    والعمليات الجارية تكمل على الفهرس الذي بدأت به
+    """
+    global EXPENSE_CATEGORIES, _keyword_index
+
+    with _install_lock:
+        # الفهرس (مع قاموسه) يُنشر في إسناد واحد، ثم يتبعه الاسم العام EXPENSE_CATEGORIES
+        index = KeywordIndex(categories, supersedes=EXPENSE_CATEGORIES)
+        _keyword_index = index
+        EXPENSE_CATEGORIES = categories
+
+    if _persistent_cache is not None:
+        _persistent_cache.purge(get_ruleset_version())
+
+    return index
+
+
+class CategoriesFileWatcher:
+    """
+    مراقبة ملف القاموس الخارجي وإعادة بناء الفهرس في الخلفية عند تغيره
+    """
+
+    def __init__(self, path: str, interval: float = 5.0):
+        self.path = path
+        self.interval = interval
+        self._stat = None
+        self._thread = _BackgroundThread(self._watch_loop, 'categories-watcher')
+
+    def check(self) -> bool:
+        """تحميل الملف إذا تغير منذ آخر فحص، ويُرجع True إذا استُبدل الفهرس"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._stat:
+            return False
+
+        # ملف غير صالح (أو أثناء كتابته) يُبقي الفهرس الحالي ويُعاد فحصه في المرة القادمة
+        categories = load_categories_file(self.path)
+        self._stat = signature
+
+        if _keyword_index is not None and categories_version(categories) == _keyword_index.version:
+            return False
+
+        install_categories(categories)
+        return True
+
+    def ensure_running(self) -> None:
+        self._thread.ensure_running()
+
+    def _watch_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"⚠️ تعذر تحميل ملف التصنيفات {self.path}، الإبقاء على القاموس الحالي: {str(e)}")
+
+
+# مسار ملف القاموس الخارجي (JSON)؛ بدونه يُستخدم القاموس المدمج في الكود
+CATEGORIES_FILE = os.environ.get('EXPENSE_CATEGORIES_FILE')
+
+_categories_watcher = None
+if CATEGORIES_FILE:
+    _categories_watcher = CategoriesFileWatcher(
+        CATEGORIES_FILE, float(os.environ.get('CATEGORIES_RELOAD_INTERVAL', 5))
+    )
+    try:
+        _categories_watcher.check()
+    except Exception as e:
+        logger.warning(f"⚠️ تعذر تحميل ملف التصنيفات {CATEGORIES_FILE}، استخدام القاموس المدمج: {str(e)}")
+
+get_keyword_index()
+
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def _word_boundaries(text: str) -> Set[int]:
+    """
+    مواقع حدود الكلمات في النص (نفس مواقع \\b): بداية ونهاية كل تسلسل أحرف كلمات
+    """
+    boundaries = set()
+    for match in _WORD_PATTERN.finditer(text):
+        boundaries.add(match.start())
+        boundaries.add(match.end())
+    return boundaries
+
+
+def _score_ceiling(origin: KeywordOrigin, found: bool) -> int:
+    """
+    أعلى نقاط يمكن أن يحصل عليها أصل الكلمة: التطابق الكامل إذا وُجدت في النص،
+    وإلا مستوى "ملتصق" (غير متاح للأصول المطبعة)
+    """
+    if found:
+        return (98 if origin.normalized else 100) + origin.bonus
+    if origin.normalized:
+        return 0
+    return 70 + origin.bonus
+
+
+def _keyword_tiers(entry: CanonicalKeyword, desc_lower: str, found: bool,
+                   found_glued: bool, whole_word: bool) -> Tuple[Tuple[int, str], Tuple[int, str]]:
+    """
+    حساب مستوى التطابق للكلمة الموحدة مرة واحدة:
+    للأصول غير المتأثرة بالتطبيع (100/95/90/85/75/70) وللأصول المطبعة (98/83/73)
+    """
+    text = entry.text
+
+    if found and text == desc_lower:
+        return (100, "تطابق كامل"), (98, "تطابق كامل (مطبع)")
+
+    if found and desc_lower.startswith(text):
+        raw_tier = (95, "بداية النص")
+    elif found and desc_lower.endswith(text):
+        raw_tier = (90, "نهاية النص")
+    elif whole_word:
+        raw_tier = (85, "كلمة كاملة")
+    elif found:
+        raw_tier = (75, "جزء من النص")
+    elif found_glued:
+        raw_tier = (70, "ملتصق")
+    else:
+        raw_tier = (0, "")
+
+    # الأشكال الأصلية المختلفة عن الموحدة لا تظهر أبداً في نص مطبع،
+    # لذا لم يكن مستوى "ملتصق" متاحاً لها ونحافظ على ذلك
+    if whole_word:
+        normalized_tier = (83, "كلمة كاملة (مطبعة)")
+    elif found:
+        normalized_tier = (73, "جزء من النص (مطبع)")
+    else:
+        normalized_tier = (0, "")
+
+    return raw_tier, normalized_tier
 
 
 def extract_payment_method(description: str) -> Optional[str]:
@@ -1821,6 +2290,107 @@ def extract_payment_method(description: str) -> Optional[str]:
     return None
 
 
+# أنماط الأجزاء غير المهمة (أنماط أكثر شمولية)
+CLEANUP_PATTERNS = [
+    # معرفات المدن والمناطق (فقط إذا لم تكن جزء من كلمة مفتاحية)
+    r'[A-Z]{3}\d+[A-Z]{2}\s*[A-Z]+',
+    r'JEDHAH?\s+MADA',
+    r'JEDDAH\s+MADA',
+    r'[A-Z]{3}\s+SA\b',
+    
+    # أرقام البطاقات والمراجع
+    r'\*{3,}\d{4}',
+    r'\d{4}\*{3,}',
+    r'xxxx\d{4}',
+    r'\*{4,}',
+    r'x{4,}',
+    
+    # معلومات تقنية
+    r'MCC[:\-]?\s*\d+',
+    r'ID:\s*\d+',
+    r'REF:\s*\w+',
+    r'TRN:\s*\w+',
+    r'TERMINAL:\s*\w+',
+    r'MERCHANT:\s*\w+',
+    
+    # أرقام مرجعية طويلة
+    r'SANBCBNK\d+',
+    r'\b\d{10,}\b',
+    
+    # عبارات الدفع (مع التحقق من الكلمات المفتاحية)
+    r'ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊ',
+    r'ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖ',
+    r'VAT CHRG:\s*[\d.]+\s*[\d.]+'
+]
+
+# أنماط الإزالة مجمّعة مسبقاً، وتُطبق بالترتيب نمطاً بعد نمط
+_CLEANUP_REGEXES = [re.compile(pattern, re.IGNORECASE) for pattern in CLEANUP_PATTERNS]
+
+# أحرف يطابقها re.IGNORECASE مع حروف قوائم الإزالة دون أن تحولها lower() إليها
+_IGNORECASE_FOLD = str.maketrans({'İ': 'i', 'ı': 'i', 'ſ': 's'})
+
+
+def _fold_for_search(text: str) -> str:
+    """شكل النص للفحص السريع: يحتوي النص المطوي على أي تطابق لنمط قائمة بدون حساسية الأحرف"""
+    return text.translate(_IGNORECASE_FOLD).lower()
+
+
+def _compile_word_lists(excluded: frozenset = frozenset()) -> List[Tuple[Optional[str], re.Pattern]]:
+    """
+    تجميع وسائل الدفع ثم الكلمات غير المهمة بترتيبها، مع استبعاد ما يتعارض مع الكلمات المفتاحية مسبقاً
+    كل نمط مع نصه المطوي لتخطيه سريعاً إذا لم يظهر في الوصف
+    
+    الأنماط تبقى منفصلة وتُطبق بالترتيب ولا تُجمع في نمط واحد: التطبيق المتتابع يحذف النمط الأسبق في القائمة
+    من كل النص أولاً، فمثلاً "الشريط المغناطيسي" يصبح "الشريط ال" بينما يحذفه النمط المجمّع كاملاً
+    """
+    patterns = []
+    for method in PAYMENT_METHODS:
+        if isinstance(method, str):
+            if method.lower() not in excluded:
+                patterns.append((_fold_for_search(method), re.compile(re.escape(method), re.IGNORECASE)))
+        else:  # regex pattern
+            patterns.append((None, method))
+    
+    for word in IGNORE_WORDS:
+        if word.lower() not in excluded:
+            patterns.append((_fold_for_search(word), re.compile(r'\b' + re.escape(word) + r'\b', re.IGNORECASE)))
+    
+    return patterns
+
+
+# الأنماط الكاملة (بدون حماية الكلمات المفتاحية) ونسخة الحماية مرتبطة بفهرس الكلمات الحالي
+_WORD_LIST_PATTERNS = _compile_word_lists()
+_protected_word_list_patterns = None
+
+
+def get_word_list_patterns(preserve_keywords: bool = True) -> List[Tuple[Optional[str], re.Pattern]]:
+    """الحصول على أنماط الإزالة، مع إعادة بنائها إذا أعيد بناء فهرس الكلمات المفتاحية"""
+    global _protected_word_list_patterns
+    
+    if not preserve_keywords:
+        return _WORD_LIST_PATTERNS
+    
+    keyword_index = get_keyword_index()
+    cached = _protected_word_list_patterns
+    if cached is None or cached[0] is not keyword_index:
+        cached = _protected_word_list_patterns = (keyword_index, _compile_word_lists(keyword_index.keywords))
+    
+    return cached[1]
+
+
+def _remove_word_lists(text: str, patterns: List[Tuple[Optional[str], re.Pattern]]) -> str:
+    """تطبيق أنماط القوائم بالترتيب، مع تخطي ما لا يظهر نصه في الوصف الحالي"""
+    folded = _fold_for_search(text)
+    for literal, pattern in patterns:
+        if literal is not None and literal not in folded:
+            continue
+        removed = pattern.sub('', text)
+        if removed != text:
+            text = removed
+            folded = _fold_for_search(text)
+    return text
+
+
 def clean_for_classification(description: str, preserve_keywords: bool = True) -> str:
     """
     تنظيف الوصف للتصنيف مع خيار الحفاظ على الكلمات المفتاحية
@@ -1831,87 +2401,30 @@ def clean_for_classification(description: str, preserve_keywords: bool = True) -
     # تطبيع النص أولاً
     clean_desc = normalize_arabic_text(description)
     
-    # الحصول على جميع الكلمات المفتاحية إذا كنا نريد الحفاظ عليها
-    all_keywords = get_all_keywords() if preserve_keywords else set()
-    
-    # حفظ الكلمات المفتاحية الموجودة في النص
-    preserved_keywords = []
-    if preserve_keywords:
-        desc_lower = clean_desc.lower()
-        for keyword in all_keywords:
-            if keyword in desc_lower:
-                # البحث عن موقع الكلمة المفتاحية وحفظها
-                pattern = re.compile(re.escape(keyword), re.IGNORECASE)
-                matches = pattern.finditer(clean_desc)
-                for match in matches:
-                    preserved_keywords.append((match.start(), match.end(), match.group()))
-    
-    # إزالة وسائل الدفع فقط إذا لم تكن من الكلمات المفتاحية
-    for method in PAYMENT_METHODS:
-        if isinstance(method, str):
-            method_lower = method.lower()
-            if method_lower not in all_keywords:
-                pattern = re.compile(re.escape(method), re.IGNORECASE)
-                clean_desc = pattern.sub('', clean_desc)
-        else:  # regex pattern
-            clean_desc = re.sub(method, '', clean_desc, flags=re.IGNORECASE)
-    
-    # إزالة الكلمات غير المهمة فقط إذا لم تكن من الكلمات المفتاحية
-    for word in IGNORE_WORDS:
-        word_lower = word.lower()
-        if word_lower not in all_keywords:
-            pattern = re.compile(r'\b' + re.escape(word) + r'\b', re.IGNORECASE)
-            clean_desc = pattern.sub('', clean_desc)
-    
-    # إزالة الأجزاء غير المهمة (أنماط أكثر شمولية)
-    patterns_to_remove = [
-        # معرفات المدن والمناطق (فقط إذا لم تكن جزء من كلمة مفتاحية)
-        r'[A-Z]{3}\d+[A-Z]{2}\s*[A-Z]+',
-        r'JEDHAH?\s+MADA',
-        r'JEDDAH\s+MADA',
-        r'[A-Z]{3}\s+SA\b',
-        
-        # أرقام البطاقات والمراجع
-        r'\*{3,}\d{4}',
-        r'\d{4}\*{3,}',
-        r'xxxx\d{4}',
-        r'\*{4,}',
-        r'x{4,}',
-        
-        # معلومات تقنية
-        r'MCC[:\-]?\s*\d+',
-        r'ID:\s*\d+',
-        r'REF:\s*\w+',
-        r'TRN:\s*\w+',
-        r'TERMINAL:\s*\w+',
-        r'MERCHANT:\s*\w+',
-        
-        # أرقام مرجعية طويلة
-        r'SANBCBNK\d+',
-        r'\b\d{10,}\b',
-        
-        # عبارات الدفع (مع التحقق من الكلمات المفتاحية)
-        r'ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊ',
-        r'ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖ',
-        r'VAT CHRG:\s*[\d.]+\s*[\d.]+'
-    ]
-    
-    # تطبيق أنماط الإزالة مع الحذر
-    for pattern in patterns_to_remove:
-        # تحقق من أن النمط لا يحذف كلمة مفتاحية
-        temp_desc = re.sub(pattern, ' ', clean_desc, flags=re.IGNORECASE)
-        
-        # إذا لم نحذف أي كلمة مفتاحية، نطبق التغيير
-        if preserve_keywords:
-            temp_lower = temp_desc.lower()
-            keywords_intact = all(any(keyword in temp_lower for keyword in all_keywords 
-                                    if keyword in clean_desc.lower()) 
-                                for keyword in all_keywords 
-                                if keyword in clean_desc.lower())
-            if keywords_intact:
-                clean_desc = temp_desc
-        else:
-            clean_desc = temp_desc
+    # إزالة وسائل الدفع ثم الكلمات غير المهمة (عدا ما يتعارض مع الكلمات المفتاحية)
+    clean_desc = _remove_word_lists(clean_desc, get_word_list_patterns(preserve_keywords))
+    
+    # إزالة الأجزاء غير المهمة نمطاً بعد نمط؛ يُرفض النمط إذا حذف جميع الكلمات المفتاحية الموجودة
+    # (لا تُجمع الأنماط في مرور واحد: قرار كل نمط يعتمد على النص بعد الأنماط التي قبله)
+    keyword_index = get_keyword_index() if preserve_keywords else None
+    present = None
+    for pattern in _CLEANUP_REGEXES:
+        if not pattern.search(clean_desc):
+            continue
+        temp_desc = pattern.sub(' ', clean_desc)
+        
+        if keyword_index is not None:
+            if present is None:
+                present = keyword_index.keywords_in(clean_desc.lower())
+            if present:
+                remaining = keyword_index.keywords_in(temp_desc.lower())
+                if present.isdisjoint(remaining):
+                    continue
+                present = remaining
+            else:
+                present = None
+        
+        clean_desc = temp_desc
     
     # تنظيف المسافات الزائدة والرموز
     clean_desc = re.sub(r'[^\w\s\u0600-\u06FF\-]', ' ', clean_desc)
@@ -1920,6 +2433,106 @@ def clean_for_classification(description: str, preserve_keywords: bool = True) -
     return clean_desc
 
 
+# ==================== قواعد الأولوية ====================
+
+# قاعدة أولوية: كلمات مفتاحية (نصية، تُطابق في النص مع أو بدون مسافات)
+# أو شرط خاص يُستخدم بدلاً من الكلمات
+PriorityRule = namedtuple('PriorityRule', ['keywords', 'category', 'subcategory', 'condition'])
+PriorityRule.__new__.__defaults__ = (None,)
+
+
+def _is_digital_channel_fee(desc: str) -> bool:
+    return ("رسوم" in desc or "ضريبة" in desc) and "digital channel" in desc
+
+
+# قائمة الأولويات الخاصة (يتم فحصها أولاً وبالترتيب)
+PRIORITY_RULES = (
+    # بطاقة ائتمانية
+    PriorityRule(
+        keywords=("مدفوعات بطاقة إئتمانية", "card: 430259 payment", "ﻣﺪﻓﻮﻋﺎﺕ ﺑﻄﺎﻗﺔ ﺇﺋﺘﻤﺎﻧﻴﺔ"),
+        category="💳 رسوم بنكية",
+        subcategory="بطاقة ائتمانية"
+    ),
+    # تحويلات بنكية
+    PriorityRule(
+        keywords=("ben id", "benbk", "تحويل الى الاهل والاصدقاء", "حوالة فورية محلية صادرة",
+                  "تحويل لأفراد", "تحويل داخلي صادر", "الأسرة أو الأصدقا"),
+        category="🔄 تحويلات مالية",
+        subcategory="تحويل داخلي/خارجي"
+    ),
+    # قروض وأقساط
+    PriorityRule(
+        keywords=("خصم قسط قرض", "خصم قسط تمويل", "قسط عقاري", "قسط تأجيري"),
+        category="🔄 تحويلات مالية",
+        subcategory="تمويل وسداد"
+    ),
+    # خدمات سداد
+    PriorityRule(
+        keywords=("مدفوعات سداد", "093-المخالفات المرورية", "090-خدمات المقيمين",
+                  "002-الشركة السعودية للكهرباء", "044-زين"),
+        category="🔄 تحويلات مالية",
+        subcategory="تمويل وسداد"
+    ),
+    # رسوم بنكية
+    PriorityRule(
+        keywords=("city: digital channel", "رسوم تحويل", "ضريبة القيمة المضافة"),
+        condition=_is_digital_channel_fee,
+        category="💳 رسوم بنكية",
+        subcategory="رسوم خدمات بنكية"
+    ),
+    # خدمات آبل
+    PriorityRule(
+        keywords=("apple pay - دولية", "apple pay ون ديولانوما", "wiatro city",
+                  "dewanlamashshakira1", "apple pay عملية دولية", "mcc- 6540"),
+        category="🎧 اشتراكات تلقائية",
+        subcategory="خدمات آبل"
+    ),
+)
+
+
+class PriorityMatcher:
+    """
+    تجميع قواعد الأولوية في آلة واحدة تُرجع أول قاعدة متطابقة بالترتيب
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.automaton = KeywordAutomaton()
+
+        for rule_id, rule in enumerate(self.rules):
+            # القواعد ذات الشرط تعتمد على الشرط فقط
+            if rule.condition is not None:
+                continue
+            for keyword_pos, keyword in enumerate(rule.keywords):
+                keyword_lower = keyword.lower()
+                for form in {keyword_lower, normalize_arabic_text(keyword_lower)}:
+                    self.automaton.add(form, (rule_id, keyword_pos))
+
+        self.automaton.build()
+
+    def match(self, desc_lower: str, desc_no_spaces: str) -> Optional[Tuple[PriorityRule, Optional[str]]]:
+        """
+        إرجاع (القاعدة، الكلمة المتطابقة) لأول قاعدة متطابقة، والكلمة None للقواعد ذات الشرط
+        """
+        hits = {}
+        for text in (desc_lower, desc_no_spaces):
+            for _, (rule_id, keyword_pos) in self.automaton.iter_matches(text):
+                if keyword_pos < hits.get(rule_id, keyword_pos + 1):
+                    hits[rule_id] = keyword_pos
+
+        for rule_id, rule in enumerate(self.rules):
+            if rule.condition is not None:
+                if rule.condition(desc_lower):
+                    return rule, None
+            elif rule_id in hits:
+                return rule, rule.keywords[hits[rule_id]]
+
+        return None
+
+
+_priority_matcher = PriorityMatcher(PRIORITY_RULES)
+
+
 def classify_transaction(description: str, debug: bool = False) -> Tuple[str, str]:
     """
     تصنيف المعاملة إلى تصنيف رئيسي وفرعي مع تحسينات
@@ -1946,144 +2559,85 @@ def classify_transaction(description: str, debug: bool = False) -> Tuple[str, st
         print(f"DEBUG: بعد التنظيف: {desc_clean}")
         print(f"DEBUG: بدون مسافات: {desc_no_spaces}")
     
-    # قائمة الأولويات الخاصة (يتم فحصها أولاً)
-    priority_checks = [
-        # بطاقة ائتمانية
-        {
-            "keywords": ["مدفوعات بطاقة إئتمانية", "card: 430259 payment", "ﻣﺪﻓﻮﻋﺎﺕ ﺑﻄﺎﻗﺔ ﺇﺋﺘﻤﺎﻧﻴﺔ"],
-            "category": "💳 رسوم بنكية",
-            "subcategory": "بطاقة ائتمانية"
-        },
-        # تحويلات بنكية
-        {
-            "keywords": ["ben id", "benbk", "تحويل الى الاهل والاصدقاء", "حوالة فورية محلية صادرة",
-                        "تحويل لأفراد", "تحويل داخلي صادر", "الأسرة أو الأصدقا"],
-            "category": "🔄 تحويلات مالية",
-            "subcategory": "تحويل داخلي/خارجي"
-        },
-        # قروض وأقساط
-        {
-            "keywords": ["خصم قسط قرض", "خصم قسط تمويل", "قسط عقاري", "قسط تأجيري"],
-            "category": "🔄 تحويلات مالية",
-            "subcategory": "تمويل وسداد"
-        },
-        # خدمات سداد
-        {
-            "keywords": ["مدفوعات سداد", "093-المخالفات المرورية", "090-خدمات المقيمين",
-                        "002-الشركة السعودية للكهرباء", "044-زين"],
-            "category": "🔄 تحويلات مالية",
-            "subcategory": "تمويل وسداد"
-        },
-        # رسوم بنكية
-        {
-            "keywords": ["city: digital channel", "رسوم تحويل", "ضريبة القيمة المضافة"],
-            "condition": lambda desc: ("رسوم" in desc or "ضريبة" in desc) and "digital channel" in desc,
-            "category": "💳 رسوم بنكية",
-            "subcategory": "رسوم خدمات بنكية"
-        },
-        # خدمات آبل
-        {
-            "keywords": ["apple pay - دولية", "apple pay ون ديولانوما", "wiatro city",
-                        "dewanlamashshakira1", "apple pay عملية دولية", "mcc- 6540"],
-            "category": "🎧 اشتراكات تلقائية",
-            "subcategory": "خدمات آبل"
-        }
-    ]
-    
-    # فحص الأولويات الخاصة
-    for check in priority_checks:
-        if "condition" in check:
-            if check["condition"](desc_lower):
-                if debug:
-                    print(f"DEBUG: تطابق مع شرط خاص: {check['category']} - {check['subcategory']}")
-                return check["category"], check["subcategory"]
-        else:
-            for keyword in check["keywords"]:
-                keyword_lower = keyword.lower()
-                keyword_normalized = normalize_arabic_text(keyword_lower)
-                
-                if (keyword_lower in desc_lower or 
-                    keyword_lower in desc_no_spaces or
-                    keyword_normalized in desc_lower or
-                    keyword_normalized in desc_no_spaces):
-                    if debug:
-                        print(f"DEBUG: تطابق أولوية مع: {keyword}")
-                    return check["category"], check["subcategory"]
-    
-    # البحث في جميع التصنيفات مع نظام نقاط محسن
+    # فحص الأولويات الخاصة في مرور واحد عبر جدول القواعد المجمّع
+    priority = _priority_matcher.match(desc_lower, desc_no_spaces)
+    if priority:
+        rule, keyword = priority
+        if debug:
+            if keyword is None:
+                print(f"DEBUG: تطابق مع شرط خاص: {rule.category} - {rule.subcategory}")
+            else:
+                print(f"DEBUG: تطابق أولوية مع: {keyword}")
+        return rule.category, rule.subcategory
+    
+    # البحث عن الكلمات المرشحة في مرور واحد على النص بدلاً من فحص كل كلمات القاموس
+    index = get_keyword_index()
+    # حدود الكلمات تُحسب مرة واحدة، والتطابق "كلمة كاملة" يبدأ وينتهي على حد كلمة
+    boundaries = _word_boundaries(desc_lower)
+    hits = set()
+    whole_word_hits = set()
+    for start, entry_id in index.automaton.iter_matches(desc_lower):
+        hits.add(entry_id)
+        if start in boundaries and start + len(index.entries[entry_id].text) in boundaries:
+            whole_word_hits.add(entry_id)
+    glued_hits = {entry_id for _, entry_id in index.glued_automaton.iter_matches(desc_no_spaces)}
+
+    # ترتيب المرشحين حسب أعلى نقاط ممكنة ثم ترتيب القاموس، للتوقف عند استحالة التحسن
+    candidates = []
+    for entry_id in hits | glued_hits:
+        found = entry_id in hits
+        for origin in index.entries[entry_id].origins:
+            ceiling = _score_ceiling(origin, found)
+            if ceiling:
+                candidates.append((-ceiling, origin.order, entry_id, origin))
+    candidates.sort(key=lambda candidate: candidate[:2])
+
+    # نظام نقاط محسن على الكلمات المرشحة فقط
     best_match = None
     best_score = 0
+    best_order = 0
     best_keyword = ""
-    all_matches = []  # لحفظ جميع التطابقات للـ debug
-    
-    for main_category, subcategories in EXPENSE_CATEGORIES.items():
-        for sub_category, keywords in subcategories.items():
-            for keyword in keywords:
-                keyword_lower = keyword.lower()
-                keyword_normalized = normalize_arabic_text(keyword_lower)
-                keyword_no_spaces = keyword_lower.replace(" ", "")
-                
-                # تخطي إذا كانت الكلمة قصيرة جداً
-                if len(keyword_lower) < 3:
-                    continue
-                
-                # حساب نقاط التطابق بنظام محسن
-                score = 0
-                match_type = ""
-                
-                # التحقق من التطابقات المختلفة
-                checks = [
-                    (keyword_lower == desc_lower, 100, "تطابق كامل"),
-                    (keyword_normalized == desc_lower, 98, "تطابق كامل (مطبع)"),
-                    (desc_lower.startswith(keyword_lower + ' ') or desc_lower.startswith(keyword_lower), 95, "بداية النص"),
-                    (desc_lower.endswith(' ' + keyword_lower) or desc_lower.endswith(keyword_lower), 90, "نهاية النص"),
-                    (re.search(r'\b' + re.escape(keyword_lower) + r'\b', desc_lower), 85, "كلمة كاملة"),
-                    (re.search(r'\b' + re.escape(keyword_normalized) + r'\b', desc_lower), 83, "كلمة كاملة (مطبعة)"),
-                    (keyword_lower in desc_lower, 75, "جزء من النص"),
-                    (keyword_normalized in desc_lower, 73, "جزء من النص (مطبع)"),
-                    (keyword_no_spaces in desc_no_spaces, 70, "ملتصق")
-                ]
-                
-                for condition, points, match_desc in checks:
-                    if condition:
-                        score = points
-                        match_type = match_desc
-                        break
-                
-                # إضافة نقاط إضافية للكلمات المحددة
-                specific_keywords = [
-                    "khaled ﺑﺎﺳﻤﺢ", "f. s. t. co", "musaned", "coarse grind", 
-                    "aya mall bindaw", "bright stage", "digital channel", "ben id",
-                    "apple pay - دولية", "خدمات المقيمين", "رسوم ديجيتال",
-                    "مدفوعات بطاقة إئتمانية", "card: 430259"
-                ]
-                
-                if keyword_lower in specific_keywords:
-                    score += 20
-                    match_type += " (كلمة خاصة)"
-                
-                # إضافة نقاط للكلمات الطويلة
-                if len(keyword_lower) >= 10:
-                    score += 10
-                elif len(keyword_lower) >= 6:
-                    score += 5
-                
-                # حفظ التطابق إذا كان له نقاط
-                if score > 0:
-                    all_matches.append({
-                        'keyword': keyword,
-                        'category': main_category,
-                        'subcategory': sub_category,
-                        'score': score,
-                        'type': match_type
-                    })
-                
-                # تحديث أفضل تطابق
-                if score > best_score:
-                    best_score = score
-                    best_match = (main_category, sub_category)
-                    best_keyword = keyword
-    
+    all_matches = [] if debug else None  # لحفظ جميع التطابقات للـ debug
+    entry_tiers = {}
+
+    for negative_ceiling, order, entry_id, origin in candidates:
+        # لا يمكن لأي مرشح متبقٍ أن يتفوق على أفضل تطابق (إلا في وضع debug لعرض الجميع)
+        ceiling = -negative_ceiling
+        if not debug and (ceiling < best_score or (ceiling == best_score and order > best_order)):
+            break
+
+        tiers = entry_tiers.get(entry_id)
+        if tiers is None:
+            tiers = entry_tiers[entry_id] = _keyword_tiers(
+                index.entries[entry_id], desc_lower, entry_id in hits, entry_id in glued_hits,
+                entry_id in whole_word_hits
+            )
+
+        score, match_type = tiers[origin.normalized]
+        if not score:
+            continue
+
+        # إضافة نقاط إضافية للكلمات المحددة والطويلة
+        if origin.bonus >= 20:
+            match_type += " (كلمة خاصة)"
+        score += origin.bonus
+
+        if debug:
+            all_matches.append({
+                'keyword': origin.keyword,
+                'category': origin.main_category,
+                'subcategory': origin.sub_category,
+                'score': score,
+                'type': match_type
+            })
+
+        # تحديث أفضل تطابق (عند التساوي يفوز الأسبق في القاموس)
+        if score > best_score or (score == best_score and order < best_order):
+            best_score = score
+            best_order = order
+            best_match = (origin.main_category, origin.sub_category)
+            best_keyword = origin.keyword
+
     if debug and all_matches:
         print(f"\nDEBUG: جميع التطابقات:")
         sorted_matches = sorted(all_matches, key=lambda x: x['score'], reverse=True)
@@ -2175,8 +2729,11 @@ def clean_description(description: str) -> str:
     return desc
 
 
-# للتوافق مع النظام القديم
-KEYWORD_CATEGORIES = EXPENSE_CATEGORIES
+def __getattr__(name):
+    # للتوافق مع النظام القديم: KEYWORD_CATEGORIES يتبع القاموس الحالي، فلا يبقى على القديم بعد إعادة التحميل
+    if name == 'KEYWORD_CATEGORIES':
+        return get_keyword_index().categories
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
@@ -2316,59 +2873,344 @@ def format_category_report(category_stats):
 # ==================== التحسينات الجديدة - نظام التصنيف المتقدم ====================
 # يمكن إضافة هذا الكود في نهاية الملف الأساسي
 
-import json
 from datetime import datetime
 from difflib import SequenceMatcher
-import os
+import atexit
+
+try:
+    import fcntl
+except ImportError:  # ويندوز: بدون قفل بين العمليات
+    fcntl = None
 
 # ==================== 1. نظام التعلم ====================
 
+class MerchantIndex:
+    """
+    فهرس شجري (Trie) لأسماء التجار المتعلمة
+    يجيب عن "أي تاجر متعلم يظهر في الوصف" بزمن يتناسب مع طول الوصف لا مع عدد التجار
+    """
+    
+    def __init__(self, merchants=()):
+        self._root = {}
+        self._ranks = {}
+        self._max_length = 0
+        
+        for merchant in merchants:
+            self.add(merchant)
+    
+    def __len__(self):
+        return len(self._ranks)
+    
+    def add(self, merchant):
+        """إضافة تاجر جديد (ترتيب الإضافة يحدد الأولوية عند تعدد التطابقات)"""
+        if merchant in self._ranks:
+            return
+        
+        self._ranks[merchant] = len(self._ranks)
+        
+        merchant_lower = merchant.lower()
+        node = self._root
+        for char in merchant_lower:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(merchant)
+        
+        self._max_length = max(self._max_length, len(merchant_lower))
+    
+    def find(self, text):
+        """أول تاجر (حسب ترتيب الإضافة) يظهر اسمه داخل النص"""
+        best = None
+        best_rank = len(self._ranks)
+        
+        for start in range(len(text)):
+            node = self._root
+            for char in text[start:start + self._max_length]:
+                node = node.get(char)
+                if node is None:
+                    break
+                for merchant in node.get(None, ()):
+                    rank = self._ranks[merchant]
+                    if rank < best_rank:
+                        best, best_rank = merchant, rank
+        
+        return best
+
+
 class ClassificationLearner:
-    """نظام تعلم بسيط لتحسين التصنيف"""
+    """
+    نظام تعلم بسيط لتحسين التصنيف
+    التخزين: لقطة كاملة (snapshot) + سجل إلحاقي (journal) لأحداث التعلم
+    عدة عمليات قد تشارك نفس الملفات: الكتابة تتم تحت قفل ملف، وأرقام الأحداث تُعطى عند الإلحاق
+    """
     
-    def __init__(self, filename='classification_patterns.json'):
+    def __init__(self, filename='classification_patterns.json', flush_interval=5.0,
+                 flush_threshold=200, compact_threshold=5000):
         self.filename = filename
-        self.patterns = self.load_patterns()
+        self.journal_filename = filename + '.journal'
+        self.lock_filename = filename + '.lock'
+        
+        # الكتابة المؤجلة: الأحداث تُجمع في الذاكرة وتُلحق بالسجل في الخلفية
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.compact_threshold = compact_threshold
+        self._pending = []
+        self._journal_events = 0
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._writer = _BackgroundThread(self._writer_loop, 'learner-writer')
+        
+        self.patterns, self._merchant_index = self.load_patterns()
+        
+        atexit.register(self.flush)
     
     def load_patterns(self):
+        """تحميل اللقطة ثم إعادة تطبيق أحداث السجل التي بعدها، مع فهرس التجار المبني منها"""
+        if not os.path.exists(self.journal_filename):
+            # لا سجل لإصلاحه، فلا حاجة لقفل (ولا لإنشاء ملف القفل عند الاستيراد)
+            return self._read_store()
+        
+        with self._store_lock():
+            return self._read_store()
+    
+    def _read_store(self):
         try:
             with open(self.filename, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {"patterns": {}, "merchants": {}, "statistics": {}}
+                patterns = json.load(f)
+        except FileNotFoundError:
+            patterns = {"patterns": {}, "merchants": {}, "statistics": {}}
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ تعذر قراءة أنماط التعلم {self.filename}، البدء بأنماط فارغة: {str(e)}")
+            patterns = {"patterns": {}, "merchants": {}, "statistics": {}}
+        
+        self._snapshot_id = self._get_snapshot_id()
+        self._seq = patterns.get("journal_seq", 0)
+        self._journal_events = 0
+        self._journal_offset = 0
+        try:
+            events = self._read_journal(patterns.get("journal_seq", 0))
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر قراءة سجل التعلم {self.journal_filename}، البدء من اللقطة وحدها: {str(e)}")
+            events = []
+        for event in events:
+            self._apply_event(patterns, event)
+        
+        return patterns, MerchantIndex(patterns["merchants"])
+    
+    def _read_journal(self, journal_seq):
+        """قراءة أحداث السجل من آخر موضع مقروء، وإرجاع ما بعد journal_seq منها دون تطبيقه"""
+        events = []
+        try:
+            with open(self.journal_filename, 'rb+') as f:
+                f.seek(self._journal_offset)
+                valid_end = self._journal_offset
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # سطر غير مكتمل (انقطاع أثناء الكتابة) يُحذف حتى لا تلتصق به الأحداث التالية
+                        f.truncate(valid_end)
+                        break
+                    valid_end += len(line)
+                    
+                    try:
+                        event = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    
+                    self._journal_events += 1
+                    if event["seq"] <= journal_seq:
+                        continue
+                    
+                    self._seq = max(self._seq, event["seq"])
+                    events.append(event)
+                self._journal_offset = valid_end
+        except FileNotFoundError:
+            pass
+        return events
+    
+    def _get_snapshot_id(self):
+        # الضغط يستبدل ملف اللقطة (os.replace) فيتغير رقمه ووقت تعديله
+        try:
+            stat = os.stat(self.filename)
+            return stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            return None
+    
+    @contextmanager
+    def _store_lock(self):
+        """قفل حصري على ملفات التعلم بين العمليات التي تشاركها"""
+        lock_file = None
+        if fcntl is not None:
+            try:
+                lock_file = open(self.lock_filename, 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except OSError as e:
+                logger.warning(f"⚠️ تعذر قفل ملفات التعلم {self.lock_filename}، المتابعة بدون قفل: {str(e)}")
+        try:
+            yield
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+    
+    def _sync_with_store(self):
+        """
+        قراءة ما كتبته العمليات الأخرى منذ آخر مزامنة (تحت _write_lock وقفل الملفات)
+        القراءة والتحليل خارج self._lock، فلا ينتظر التصنيف القرص؛ القفل يُؤخذ للتطبيق والاستبدال فقط
+        إذا ضغطت عملية أخرى السجل يُعاد التحميل ثم تُطبق الأحداث غير المحفوظة من جديد
+        """
+        if self._get_snapshot_id() != self._snapshot_id:
+            # الجيل الجديد يُبنى كاملاً (مع الأحداث غير المحفوظة) ثم يُستبدل بالأنماط والفهرس معاً
+            patterns, merchant_index = self._read_store()
+            with self._lock:
+                for event in self._pending:
+                    self._apply_event(patterns, event)
+                    if event["merchant"]:
+                        merchant_index.add(event["merchant"])
+                self.patterns, self._merchant_index = patterns, merchant_index
+        else:
+            # journal_seq لا يتغير إلا في compact، وهي تحت _write_lock مثلنا
+            events = self._read_journal(self.patterns.get("journal_seq", 0))
+            if events:
+                with self._lock:
+                    for event in events:
+                        self._apply_event(self.patterns, event)
+                        if event["merchant"]:
+                            self._merchant_index.add(event["merchant"])
     
     def save_patterns(self):
+        """حفظ فوري لجميع الأنماط (ضغط السجل في لقطة جديدة)"""
+        self.compact()
+    
+    def flush(self):
+        """إلحاق الأحداث المعلقة بالسجل وضغطه عند بلوغ الحد"""
+        with self._lock:
+            if not self._pending:
+                return
+        
+        with self._write_lock, self._store_lock():
+            try:
+                self._sync_with_store()
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ تعذرت مزامنة أنماط التعلم مع {self.filename}: {str(e)}")
+            
+            with self._lock:
+                if not self._pending:
+                    return
+                events, self._pending = self._pending, []
+                # الرقم التالي لآخر حدث في السجل المشترك، فلا تتكرر الأرقام بين العمليات
+                for event in events:
+                    self._seq += 1
+                    event["seq"] = self._seq
+            
+            lines = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+            try:
+                with open(self.journal_filename, 'ab') as f:
+                    f.write(lines.encode('utf-8'))
+                    self._journal_offset = f.tell()
+                self._journal_events += len(events)
+            except OSError as e:
+                logger.warning(f"⚠️ تعذر إلحاق {len(events)} حدث تعلم بالسجل {self.journal_filename}، ستُعاد المحاولة: {str(e)}")
+                # تبقى معلقة قبل ما أُضيف بعدها، وتأخذ أرقاماً جديدة عند الإلحاق التالي
+                with self._lock:
+                    self._pending[:0] = events
+                return
+        
+        if self._journal_events >= self.compact_threshold:
+            self.compact()
+    
+    def compact(self):
+        """كتابة لقطة كاملة بشكل ذري ثم تفريغ السجل"""
+        with self._write_lock, self._store_lock():
+            try:
+                self._sync_with_store()
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ تعذرت مزامنة أنماط التعلم مع {self.filename}: {str(e)}")
+            
+            with self._lock:
+                # الأحداث المعلقة مطبقة في الذاكرة فتدخل ضمن اللقطة
+                events, self._pending = self._pending, []
+                self.patterns["journal_seq"] = self._seq
+                # نسخة من القواميس التي يضيف إليها learn_pattern، والتسلسل نفسه خارج القفل
+                snapshot = {key: dict(value) if isinstance(value, dict) else value
+                            for key, value in self.patterns.items()}
+            
+            payload = json.dumps(snapshot, ensure_ascii=False, indent=2)
+            
+            if not self._write_file(payload):
+                # لم تُحفظ اللقطة، فتبقى الأحداث معلقة للإلحاق التالي
+                with self._lock:
+                    self._pending[:0] = events
+                return
+            self._snapshot_id = self._get_snapshot_id()
+            
+            # الأحداث القديمة في السجل تُتجاهل عند التحميل بفضل journal_seq
+            try:
+                with open(self.journal_filename, 'w', encoding='utf-8'):
+                    pass
+                self._journal_offset = 0
+                self._journal_events = 0
+            except OSError as e:
+                logger.warning(f"⚠️ تعذر تفريغ سجل التعلم {self.journal_filename}: {str(e)}")
+    
+    def _write_file(self, payload):
+        """كتابة اللقطة بشكل ذري، ويُرجع False عند الفشل"""
         try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(self.patterns, f, ensure_ascii=False, indent=2)
-        except:
-            pass
+            _atomic_write(self.filename, payload, '.patterns-')
+            return True
+        except OSError as e:
+            logger.warning(f"⚠️ تعذر حفظ لقطة أنماط التعلم {self.filename}: {str(e)}")
+            return False
+    
+    def _writer_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # خطأ غير متوقع لا يوقف الكتابة في الخلفية؛ الأحداث غير الملحقة تبقى معلقة
+                logger.warning(f"⚠️ فشل حفظ أنماط التعلم في الخلفية: {str(e)}")
+    
+    def _apply_event(self, patterns, event):
+        """تطبيق حدث تعلم واحد على الأنماط"""
+        key = event["key"]
+        
+        # المدخل يُستبدل ولا يُعدل في مكانه، فتبقى نسخة compact ثابتة أثناء تسلسلها
+        entry = patterns["patterns"].get(key) or {
+            "category": event["category"],
+            "subcategory": event["subcategory"],
+            "count": 0,
+            "first_seen": event["time"]
+        }
+        patterns["patterns"][key] = {**entry, "count": entry["count"] + 1, "last_seen": event["time"]}
+        
+        # حفظ اسم التاجر
+        merchant_name = event.get("merchant")
+        if merchant_name:
+            patterns["merchants"][merchant_name] = {
+                "category": event["category"],
+                "subcategory": event["subcategory"]
+            }
     
     def learn_pattern(self, description, category, subcategory):
         """تعلم نمط جديد"""
-        key = description.lower().strip()
-        
-        if key not in self.patterns["patterns"]:
-            self.patterns["patterns"][key] = {
+        with self._lock:
+            event = {
+                "key": description.lower().strip(),
                 "category": category,
                 "subcategory": subcategory,
-                "count": 0,
-                "first_seen": datetime.now().isoformat(),
-                "last_seen": datetime.now().isoformat()
-            }
-        
-        self.patterns["patterns"][key]["count"] += 1
-        self.patterns["patterns"][key]["last_seen"] = datetime.now().isoformat()
-        
-        # حفظ اسم التاجر
-        merchant_name = self.extract_merchant_name(description)
-        if merchant_name:
-            self.patterns["merchants"][merchant_name] = {
-                "category": category,
-                "subcategory": subcategory
+                "merchant": self.extract_merchant_name(description),
+                "time": datetime.now().isoformat()
             }
+            
+            self._apply_event(self.patterns, event)
+            if event["merchant"]:
+                self._merchant_index.add(event["merchant"])
+            
+            self._pending.append(event)
+            pending_count = len(self._pending)
         
-        self.save_patterns()
+        self._writer.ensure_running()
+        if pending_count >= self.flush_threshold:
+            self._flush_event.set()
     
     def extract_merchant_name(self, description):
         """استخراج اسم التاجر"""
@@ -2384,13 +3226,16 @@ class ClassificationLearner:
         """الحصول على تصنيف متعلم"""
         key = description.lower().strip()
         
-        if key in self.patterns["patterns"]:
-            pattern = self.patterns["patterns"][key]
-            if pattern["count"] >= 3:
-                return (pattern["category"], pattern["subcategory"])
-        
-        for merchant, info in self.patterns["merchants"].items():
-            if merchant.lower() in key:
+        # تحت القفل: الأنماط وفهرس التجار من نفس الجيل حتى لو أعادت المزامنة تحميلهما
+        with self._lock:
+            if key in self.patterns["patterns"]:
+                pattern = self.patterns["patterns"][key]
+                if pattern["count"] >= 3:
+                    return (pattern["category"], pattern["subcategory"])
+            
+            merchant = self._merchant_index.find(key)
+            if merchant is not None:
+                info = self.patterns["merchants"][merchant]
                 return (info["category"], info["subcategory"])
         
         return None
@@ -2443,6 +3288,74 @@ class NLPProcessor:
         
         return len(intersection) / len(union)
 
+class SimilarityIndex:
+    """
+    فهرس مقلوب من كلمات (tokens) الكلمات المفتاحية إلى مدخلاتها لمرحلة المطابقة المتقدمة
+    لا تُحسب النقاط إلا للكلمات المفتاحية التي تشترك مع الوصف في كلمة واحدة على الأقل
+    """
+    
+    def __init__(self, keyword_index, nlp):
+        self.keyword_index = keyword_index
+        self.entries = []
+        self.postings = {}
+        
+        for main_category, subcategories in keyword_index.categories.items():
+            for sub_category, keywords in subcategories.items():
+                for keyword in keywords:
+                    entry_id = len(self.entries)
+                    words = frozenset(keyword.lower().split())
+                    self.entries.append((
+                        main_category, sub_category,
+                        words, frozenset(nlp.extract_keywords(keyword))
+                    ))
+                    
+                    for word in words:
+                        self.postings.setdefault(word, []).append(entry_id)
+    
+    def best_match(self, description, nlp):
+        """أفضل تصنيف بنفس معادلة النقاط السابقة، أو (None, 0)"""
+        desc_words = set(description.lower().split())
+        desc_keywords = set(nlp.extract_keywords(description))
+        
+        # بدون كلمة مشتركة يكون التشابه والكلمات المشتركة صفراً
+        candidates = set()
+        for word in desc_words:
+            candidates.update(self.postings.get(word, ()))
+        
+        best_match = None
+        best_score = 0
+        
+        # ترتيب القاموس يحدد الأولوية عند تساوي النقاط
+        for entry_id in sorted(candidates):
+            main_category, sub_category, words, keyword_keywords = self.entries[entry_id]
+            
+            similarity = 0
+            if desc_keywords and keyword_keywords:
+                similarity = len(desc_keywords & keyword_keywords) / len(desc_keywords | keyword_keywords)
+            
+            score = similarity * 50 + len(words & desc_words) * 20
+            
+            if score > best_score and score > 30:
+                best_score = score
+                best_match = (main_category, sub_category)
+        
+        return best_match, best_score
+
+
+_similarity_index = None
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """الحصول على الفهرس المقلوب، مع إعادة بنائه إذا أعيد بناء فهرس الكلمات المفتاحية"""
+    global _similarity_index
+    
+    keyword_index = get_keyword_index()
+    index = _similarity_index
+    if index is None or index.keyword_index is not keyword_index:
+        index = _similarity_index = SimilarityIndex(keyword_index, _nlp)
+    
+    return index
+
 # ==================== 3. قاعدة بيانات التجار الموسعة ====================
 
 MERCHANT_DATABASE = {
@@ -2498,6 +3411,85 @@ MERCHANT_DATABASE = {
     "ITUNES.COM": ("🎧 اشتراكات تلقائية", "خدمات آبل"),
 }
 
+def _merchants_fingerprint(merchants) -> Tuple[int, int]:
+    """فحص رخيص لكل استخدام: استبدال قاعدة التجار أو تغير عددها"""
+    return id(merchants), len(merchants)
+
+
+def _merchants_content_hash(merchants) -> int:
+    """فحص لمحتوى قاعدة التجار (بما فيه التعديل في مكانها)، يمر عليها كاملة"""
+    return hash(tuple(merchants.items()))
+
+
+class MerchantMatcher:
+    """
+    قاعدة بيانات التجار مجمّعة في آلة مطابقة واحدة (بعد توحيد حالة الأحرف والتطبيع)
+    تدعم الأسماء متعددة الكلمات والرموز مثل "THE CHEFZ" و "APPLE.COM/BILL"
+    """
+    
+    def __init__(self, merchants):
+        self.fingerprint = _merchants_fingerprint(merchants)
+        self.content_hash = _merchants_content_hash(merchants)
+        self.version = hashlib.sha1(
+            json.dumps(list(merchants.items()), ensure_ascii=False).encode('utf-8')
+        ).hexdigest()[:12]
+        
+        self._merchants = list(merchants.items())
+        self._automaton = KeywordAutomaton()
+        
+        # ترتيب القاموس يحدد الأولوية عند تطابق أكثر من تاجر
+        for rank, merchant in enumerate(merchants):
+            folded = merchant.casefold()
+            normalized = normalize_arabic_text(merchant).casefold()
+            
+            self._automaton.add(folded, rank)
+            if normalized != folded:
+                self._automaton.add(normalized, rank)
+        
+        self._automaton.build()
+    
+    def find(self, *texts):
+        """إرجاع (التاجر، التصنيف) لأول تاجر يظهر في أي من النصوص، أو None"""
+        best = None
+        
+        for text in texts:
+            for _, rank in self._automaton.iter_matches(text.casefold()):
+                if best is None or rank < best:
+                    best = rank
+        
+        return self._merchants[best] if best is not None else None
+
+
+_merchant_matcher = None
+
+
+def get_merchant_matcher() -> MerchantMatcher:
+    """الحصول على مطابق التجار المشترك، مع إعادة بنائه إذا تغيرت قاعدة البيانات"""
+    global _merchant_matcher
+    
+    matcher = _merchant_matcher
+    if matcher is None or matcher.fingerprint != _merchants_fingerprint(MERCHANT_DATABASE):
+        matcher = _merchant_matcher = MerchantMatcher(MERCHANT_DATABASE)
+    
+    return matcher
+
+
+def refresh_merchant_matcher() -> MerchantMatcher:
+    """
+    مثل get_merchant_matcher مع فحص محتوى قاعدة التجار، لاكتشاف التعديل في مكانها
+    يُستدعى مرة في بداية كل عملية تصنيف (keyword_index_snapshot) وليس لكل وصف
+    """
+    global _merchant_matcher
+    
+    matcher = get_merchant_matcher()
+    if matcher.content_hash != _merchants_content_hash(MERCHANT_DATABASE):
+        matcher = _merchant_matcher = MerchantMatcher(MERCHANT_DATABASE)
+    
+    return matcher
+
+
+get_merchant_matcher()
+
 # ==================== 4. إنشاء مثيلات عامة ====================
 
 # إنشاء مثيلات من الأنظمة المساعدة
@@ -2531,88 +3523,177 @@ def classify_transaction(description: str, amount: float = 0, date: str = "", de
             print(f"DEBUG: تصنيف متعلم: {learned}")
         return learned
     
-    # 3. البحث في قاعدة بيانات التجار
-    desc_upper = clean_desc.upper()
-    for merchant, category in MERCHANT_DATABASE.items():
-        if merchant in desc_upper or merchant in description.upper():
-            if debug:
-                print(f"DEBUG: تاجر معروف: {merchant} => {category}")
-            # حفظ النمط للتعلم
-            _learner.learn_pattern(description, category[0], category[1])
-            return category
+    # 3-5. قاعدة التجار ثم الكلمات المفتاحية ثم المطابقة المتقدمة
+    result = _classify_by_rules(description, normalized_desc, clean_desc, debug)
+    
+    # 6. التعلم من النتيجة
+    if result[0] != "❓ غير مصنف":
+        _learner.learn_pattern(description, result[0], result[1])
+    
+    return result
+
+
+def _classify_by_rules(description: str, normalized_desc: str, clean_desc: str,
+                       debug: bool = False) -> Tuple[str, str]:
+    """
+    مراحل التصنيف التي لا تعتمد على الأنماط المتعلمة: نتيجتها ثابتة لنفس الوصف وإصدار القواعد
+    """
+    # 3. البحث في قاعدة بيانات التجار (مرور واحد على الوصف المنظف والمطبع)
+    merchant_match = get_merchant_matcher().find(clean_desc, normalized_desc)
+    if merchant_match:
+        merchant, category = merchant_match
+        if debug:
+            print(f"DEBUG: تاجر معروف: {merchant} => {category}")
+        return category
     
     # 4. استخدام دالة التصنيف الأصلية
     result = _original_classify_transaction(description, debug)
     
     # 5. إذا فشل التصنيف، نحاول مطابقة متقدمة
     if result[0] == "❓ غير مصنف":
-        # استخراج الكلمات المفتاحية
-        keywords = _nlp.extract_keywords(clean_desc)
-        
-        # البحث عن أفضل تطابق
-        best_match = None
-        best_score = 0
-        
-        for main_cat, subcats in EXPENSE_CATEGORIES.items():
-            for sub_cat, category_keywords in subcats.items():
-                for keyword in category_keywords:
-                    # حساب التشابه
-                    similarity = _nlp.calculate_similarity(clean_desc, keyword)
-                    
-                    # نقاط إضافية للكلمات المشتركة
-                    keyword_words = set(keyword.lower().split())
-                    desc_words = set(clean_desc.lower().split())
-                    common_words = keyword_words & desc_words
-                    
-                    score = similarity * 50 + len(common_words) * 20
-                    
-                    if score > best_score and score > 30:
-                        best_score = score
-                        best_match = (main_cat, sub_cat)
+        # البحث عن أفضل تطابق بين الكلمات المفتاحية المشتركة مع الوصف فقط
+        best_match, best_score = get_similarity_index().best_match(clean_desc, _nlp)
         
         if best_match:
             if debug:
                 print(f"DEBUG: مطابقة متقدمة: {best_match} (نقاط: {best_score})")
             result = best_match
     
-    # 6. التعلم من النتيجة
-    if result[0] != "❓ غير مصنف":
-        _learner.learn_pattern(description, result[0], result[1])
-    
     return result
 
 # ==================== 6. واجهة محسنة للاستخدام (اختيارية) ====================
 
+class LRUCache:
+    """ذاكرة مؤقتة محدودة الحجم (الأقدم استخداماً يُحذف أولاً) مع عدادات"""
+    
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self):
+        """إحصائيات الذاكرة المؤقتة"""
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+# يُرفع يدوياً عند أي تغيير في منطق المطابقة نفسه (الترجيح، التشابه، ترتيب المراحل في _classify_by_rules)
+# لأن تغيير الكود لا يظهر في بصمات الجداول، فتُهمل نتائج الذاكرة الدائمة المحسوبة بالمنطق القديم
+RULES_SCHEMA_VERSION = 1
+
+_rules_tables_version = (None, None)
+
+
+def rules_tables_version() -> str:
+    """بصمة جداول القواعد غير القاموس وقاعدة التجار: الأولويات ووسائل الدفع والكلمات المتجاهلة وأنماط التنظيف"""
+    global _rules_tables_version
+
+    tables = (PRIORITY_RULES, PAYMENT_METHODS, IGNORE_WORDS, CLEANUP_PATTERNS)
+    identity = tuple(id(table) for table in tables)
+    cached_identity, version = _rules_tables_version
+    if cached_identity != identity:
+        payload = json.dumps([
+            [[list(rule.keywords), rule.category, rule.subcategory,
+              rule.condition.__qualname__ if rule.condition else None] for rule in PRIORITY_RULES],
+            list(PAYMENT_METHODS), list(IGNORE_WORDS), list(CLEANUP_PATTERNS)
+        ], ensure_ascii=False)
+        version = hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+        _rules_tables_version = (identity, version)
+    return version
+
+
+def get_ruleset_version() -> str:
+    """
+    إصدار قواعد التصنيف (مرة لكل عملية تصنيف): إصدار منطق المطابقة وبصمات جداول القواعد
+    وقاموس التصنيفات وقاعدة بيانات التجار
+    """
+    with keyword_index_snapshot() as index:
+        if _pinned_index.version is None:
+            _pinned_index.version = (f"{RULES_SCHEMA_VERSION}-{rules_tables_version()}-"
+                                     f"{index.version}-{get_merchant_matcher().version}")
+        return _pinned_index.version
+
+
+def description_key(description: str) -> str:
+    """مفتاح موحد للوصف (المبلغ والتاريخ لا يؤثران على التصنيف)"""
+    return normalize_arabic_text(description or "").lower().strip()
+
+
 class TransactionClassifier:
     """واجهة موحدة لنظام التصنيف المتقدم"""
     
-    def __init__(self):
+    def __init__(self, cache_size=10000):
         self.learner = _learner
         self.nlp = _nlp
-        self.cache = {}
+        self.cache = LRUCache(cache_size)
     
     def classify(self, description, amount=0, date=None):
         """تصنيف معاملة"""
-        cache_key = f"{description}_{amount}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+        with keyword_index_snapshot():
+            cache_key = (get_ruleset_version(), description_key(description))
+            result = self.cache.get(cache_key)
+            if result is not None:
+                return result
+            
+            result = classify_transaction(description, amount, date or "", False)
         
-        result = classify_transaction(description, amount, date or "", False)
-        self.cache[cache_key] = result
+        self.cache.put(cache_key, result)
         return result
     
     def classify_batch(self, transactions):
-        """تصنيف مجموعة معاملات"""
+        """تصنيف مجموعة معاملات (كل وصف فريد يُصنف مرة واحدة)"""
+        with keyword_index_snapshot():
+            return self._classify_batch(transactions)
+    
+    def _classify_batch(self, transactions):
+        unique_results = {}
         results = []
         for trans in transactions:
             desc = trans.get("description", "")
             amount = trans.get("amount", 0)
             date = trans.get("date", "")
             
-            classification = self.classify(desc, amount, date)
+            key = description_key(desc)
+            if key not in unique_results:
+                unique_results[key] = self.classify(desc, amount, date)
+            
             results.append({
                 "original": trans,
-                "classification": classification
+                "classification": unique_results[key]
             })
         
         return results
@@ -2639,6 +3720,16 @@ def classify_alrajhi_transaction(description: str) -> Tuple[str, str]:
     """
     تصنيف خاص لمعاملات بنك الراجحي
     """
+    result = _alrajhi_special_classification(description)
+    if result is not None:
+        return result
+    
+    # إذا لم يتم العثور على تصنيف خاص، استخدم التصنيف العام
+    return classify_transaction(description)
+
+
+def _alrajhi_special_classification(description: str) -> Optional[Tuple[str, str]]:
+    """فحوصات الراجحي الخاصة، أو None إذا لم ينطبق أي منها"""
     desc_lower = description.lower()
     
     # فحوصات خاصة لمعاملات الراجحي
@@ -2655,5 +3746,238 @@ def classify_alrajhi_transaction(description: str) -> Tuple[str, str]:
     if "سحب نقدي" in description or "atm withdrawal" in desc_lower:
         return "🏦 معاملات بنكية", "سحب نقدي"
     
-    # إذا لم يتم العثور على تصنيف خاص، استخدم التصنيف العام
-    return classify_transaction(description)
+    return None
+
+
+# ==================== 7. ذاكرة التصنيف الدائمة ====================
+
+import sqlite3
+
+
+class PersistentClassificationCache:
+    """
+    ذاكرة تصنيف دائمة على القرص (SQLite) تبقى بعد إعادة تشغيل العمليات
+    المفتاح يتضمن إصدار القواعد، فتتجاهل النتائج القديمة تلقائياً عند تغير القاموس أو قاعدة التجار أو جداول القواعد ومنطقها
+    نتائج الإصدارات الأخرى تُحذف عند أول تصنيف في العملية وعند استبدال القاموس فقط (purge)، وليس عند الكتابة:
+    عمليات بإصدارات مختلفة (أثناء إعادة التحميل أو إعادة التشغيل التدريجية) تشارك نفس الملف
+    """
+    
+    def __init__(self, filename='classification_cache.sqlite3'):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._purged_pid = None
+    
+    @staticmethod
+    def make_key(description, version):
+        payload = f"rules\x00{version}\x00{description_key(description)}"
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    def _connect(self):
+        # اتصال لكل عملية (لا يصح مشاركة اتصال SQLite بعد fork)
+        if self._connection is not None and self._connection_pid == os.getpid():
+            return self._connection
+        
+        connection = sqlite3.connect(self.filename, timeout=5, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            "key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+            "main_category TEXT NOT NULL, sub_category TEXT NOT NULL)"
+        )
+        connection.commit()
+        
+        self._connection = connection
+        self._connection_pid = os.getpid()
+        return connection
+    
+    def get(self, key):
+        """النتيجة المحفوظة (رئيسي، فرعي) أو None"""
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT main_category, sub_category FROM classifications WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        
+        return (row[0], row[1]) if row else None
+    
+    def put(self, key, version, result):
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?)",
+                    (key, version, result[0], result[1])
+                )
+                connection.commit()
+        except sqlite3.Error:
+            pass
+    
+    def purge_once(self, version):
+        """مثل purge مرة واحدة لكل عملية، عند أول استخدام للذاكرة وليس عند الاستيراد"""
+        if self._purged_pid == os.getpid():
+            return
+        self._purged_pid = os.getpid()
+        self.purge(version)
+    
+    def purge(self, version):
+        """حذف نتائج جميع الإصدارات عدا الإصدار المعطى"""
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute("DELETE FROM classifications WHERE version != ?", (version,))
+                connection.commit()
+        except sqlite3.Error:
+            pass
+
+
+# ملف الذاكرة الدائمة: من متغير البيئة، أو بجانب ملف أنماط التعلم
+CLASSIFICATION_CACHE_FILE = os.environ.get('CLASSIFICATION_CACHE_FILE') or os.path.join(
+    os.path.dirname(os.path.abspath(_learner.filename)), 'classification_cache.sqlite3'
+)
+_persistent_cache = PersistentClassificationCache(CLASSIFICATION_CACHE_FILE)
+
+
+def classify_cached(description: str, bank: Optional[str] = None) -> Tuple[str, str]:
+    """
+    نفس نتيجة الدالة الخاصة بالراجحي أو دالة التصنيف العامة، مع أخذ نتيجة القواعد
+    من الذاكرة الدائمة بدل تشغيلها إذا سبق حسابها
+    """
+    with keyword_index_snapshot():
+        return _classify_many([description], [bank], 1)[0]
+
+
+def classify_many(descriptions, bank: Optional[str] = None, workers: Optional[int] = None,
+                  banks=None) -> List[Tuple[str, str]]:
+    """
+    تصنيف مجموعة أوصاف دفعة واحدة بنفس نتيجة تصنيفها واحداً بعد الآخر
+    وتُعاد النتائج بنفس ترتيب الأوصاف المدخلة
+    banks (اختياري): بنك كل وصف بنفس ترتيبها، لتصنيف أوصاف عدة بنوك معاً؛ وإلا فـ bank للجميع
+    نتائج القواعد غير الموجودة في الذاكرة الدائمة تُحسب مرة لكل وصف موحد، على عدة عمليات إذا تجاوز عددها الحد
+    """
+    descriptions = list(descriptions)
+    banks = [bank] * len(descriptions) if banks is None else list(banks)
+    if len(banks) != len(descriptions):
+        raise ValueError(f"عدد البنوك ({len(banks)}) لا يطابق عدد الأوصاف ({len(descriptions)})")
+    
+    with keyword_index_snapshot():
+        return _classify_many(descriptions, banks, workers)
+
+
+def _classify_many(descriptions: List[str], banks: List[Optional[str]], workers: Optional[int]) -> List[Tuple[str, str]]:
+    version = get_ruleset_version()
+    _persistent_cache.purge_once(version)
+    results = [None] * len(descriptions)
+    
+    # الأوصاف الفارغة وفحوصات الراجحي الخاصة لا تحتاج محرك التصنيف
+    prepared = {}
+    pending = []
+    for position, (description, bank) in enumerate(zip(descriptions, banks)):
+        if not description:
+            results[position] = ("❓ غير مصنف", "غير محدد")
+            continue
+        if bank == 'الراجحي':
+            special = _alrajhi_special_classification(description)
+            if special is not None:
+                results[position] = special
+                continue
+        
+        key = description_key(description)
+        if key not in prepared:
+            normalized_desc = normalize_arabic_text(description)
+            prepared[key] = (description, normalized_desc,
+                             clean_for_classification(normalized_desc, preserve_keywords=True))
+        pending.append((position, description, key))
+    
+    # نتائج القواعد مطلوبة فقط للأوصاف غير المتعلمة الآن (النمط المتعلم لا يُنسى)
+    rules_results = {}
+    missing = []
+    for key, (description, _, clean_desc) in prepared.items():
+        if _learner.get_learned_classification(clean_desc):
+            continue
+        result = _persistent_cache.get(PersistentClassificationCache.make_key(description, version))
+        if result is None:
+            missing.append(key)
+        else:
+            rules_results[key] = result
+    
+    computed = _classify_by_rules_many([prepared[key] for key in missing], workers)
+    for key, result in zip(missing, computed):
+        rules_results[key] = result
+        # "غير مصنف" لا تُحفظ حتى لا تحجب ما قد يتعلمه النظام لاحقاً
+        if result[0] != "❓ غير مصنف":
+            _persistent_cache.put(PersistentClassificationCache.make_key(prepared[key][0], version), version, result)
+    
+    # الأنماط المتعلمة والتعلم بترتيب الأوصاف، كما في تصنيفها واحداً بعد الآخر
+    for position, description, key in pending:
+        _, normalized_desc, clean_desc = prepared[key]
+        
+        learned = _learner.get_learned_classification(clean_desc)
+        if learned:
+            results[position] = learned
+            continue
+        
+        result = rules_results.get(key)
+        if result is None:
+            result = rules_results[key] = _classify_by_rules(description, normalized_desc, clean_desc)
+        
+        if result[0] != "❓ غير مصنف":
+            _learner.learn_pattern(description, result[0], result[1])
+        results[position] = result
+    
+    return results
+
+
+# ==================== 8. التصنيف المتوازي ====================
+
+import multiprocessing
+
+# عدد عمليات التصنيف؛ الافتراضي 1 (بدون توازي) لأن كل استدعاء مؤهل ينشئ Pool جديداً بـ fork
+# من خيط الطلب بينما قد تحمل خيوط أخرى (كاتب المتعلم ومراقب ملف التصنيفات) أقفالها، فيُفعّل صراحة فقط
+# في عمليات مخصصة للتحليل الدفعي
+CLASSIFICATION_WORKERS = int(os.environ.get('CLASSIFICATION_WORKERS', 1))
+# الحد يُقارن بعدد الأوصاف الفريدة التي لم توجد نتيجتها في الذاكرة الدائمة ولم تُتعلم، وليس بعدد الصفوف؛
+# تحليل الكشف الواحد يصنف صفحة بصفحة فلا يبلغه، وإنما يبلغه تصنيف مصاريف عدة ملفات معاً بعد الاستخراج
+PARALLEL_CLASSIFICATION_THRESHOLD = int(os.environ.get('PARALLEL_CLASSIFICATION_THRESHOLD', 5000))
+
+
+def _classify_rules_shard(shard):
+    return [_classify_by_rules(*item) for item in shard]
+
+
+def _classify_by_rules_many(items: List[Tuple[str, str, str]],
+                            workers: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    نتائج القواعد لأوصاف فريدة (الوصف، المطبع، المنظف) بالترتيب، أو بتوزيعها على عمليات فرعية (fork)
+    القواعد لا تعتمد على الأنماط المتعلمة، فالنتيجة واحدة مهما كان عدد العمليات
+    """
+    if workers is None:
+        workers = CLASSIFICATION_WORKERS
+    workers = min(workers, len(items))
+    
+    if (workers <= 1 or len(items) < PARALLEL_CLASSIFICATION_THRESHOLD
+            or 'fork' not in multiprocessing.get_all_start_methods()):
+        return _classify_rules_shard(items)
+    
+    # بناء الفهارس قبل fork حتى لا تبنيها كل عملية فرعية
+    get_keyword_index()
+    get_merchant_matcher()
+    get_similarity_index()
+    
+    shard_size = -(-len(items) // workers)
+    shards = [items[start:start + shard_size] for start in range(0, len(items), shard_size)]
+    
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes=len(shards)) as pool:
+            shard_results = pool.map(_classify_rules_shard, shards)
+    except OSError:
+        return _classify_rules_shard(items)
+    
+    return [result for results in shard_results for result in results]
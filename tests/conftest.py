@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+import pytest
+
+import expense_categories as ec
+
+
+@pytest.fixture
+def new_learner(tmp_path, monkeypatch):
+    """تثبيت نظام تعلم جديد بدون أنماط محفوظة، ويمكن استدعاؤه أكثر من مرة في نفس الاختبار"""
+    runs = itertools.count()
+
+    def install():
+        learner = ec.ClassificationLearner(filename=str(tmp_path / f'patterns-{next(runs)}.json'))
+        monkeypatch.setattr(ec, '_learner', learner)
+        return learner
+    return install
+
+
+@pytest.fixture
+def new_cache(tmp_path, monkeypatch):
+    """تثبيت ذاكرة تصنيف دائمة فارغة جديدة، ويمكن استدعاؤه أكثر من مرة في نفس الاختبار"""
+    runs = itertools.count()
+
+    def install():
+        cache = ec.PersistentClassificationCache(str(tmp_path / f'cache-{next(runs)}.sqlite3'))
+        monkeypatch.setattr(ec, '_persistent_cache', cache)
+        return cache
+    return install
+
+
+@pytest.fixture
+def fresh_learner(new_learner):
+    """نظام تعلم بدون أنماط محفوظة، كما عند توليد الملف المرجعي"""
+    return new_learner()
+
+
+@pytest.fixture
+def fresh_cache(new_cache):
+    """ذاكرة تصنيف دائمة فارغة في مجلد الاختبار"""
+    return new_cache()
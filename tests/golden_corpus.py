@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+مجموعة أوصاف مرجعية (golden corpus) لاختبار ثبات نتائج التنظيف والتصنيف
+
+الأوصاف تُبنى من كلمات القاموس وأسماء التجار مع ضوضاء نقاط البيع كما تظهر في الكشوف،
+والنتائج المتوقعة تُولد من نسخة مرجعية من expense_categories.py:
+
+    python tests/golden_corpus.py /path/to/reference/checkout > tests/golden_classification.json
+"""
+
+import os
+import sys
+import json
+import random
+import tempfile
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_classification.json')
+
+# أوصاف حقيقية من كشوف الراجحي والأهلي (بأشكال العرض العربية كما يستخرجها PDF)
+STATEMENT_SAMPLES = [
+    "KHALED ﺑﺎﺳﻤﺢ ﻟﻠﺘﺴﻮﻳﻖ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊABDULLAH CITY: JEDH682016JED JEDDAH MADA***8768 VAT CHRG: 0. 00 0. 00",
+    "BEN ID: ﺗﺤﻮﻳﻞ ﺩﺍﺧﻠﻲ ﺻﺎﺩﺭ ﺗﺤﻮﻳﻞ ﺍﻟﻰ ﺍﻻﻫﻞ ﻭﺍﻻﺻﺪﻗﺎﺀ",
+    "ﺧﺼﻢ ﻗﺴﻂ ﺗﻤﻮﻳﻞ ﺗﺄﺟﻴﺮﻱ",
+    "STC Pay CITY: 0000682016SAM MCC- 6540ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖ Riyadh MADA ***1502 VAT CHRG: 0. 00 0. 00",
+    "ﻣﺪﻓﻮﻋﺎﺕ ﺳﺪﺍﺩ 002-ﺍﻟﺸﺮﻛﺔ ﺍﻟﺴﻌﻮﺩﻳﺔ ﻟﻠﻜﻬﺮﺑﺎﺀ-",
+    "ﻣﺪﻓﻮﻋﺎﺕ ﺳﺪﺍﺩ 093-ﺍﻟﻤﺨﺎﻟﻔﺎﺕ ﺍﻟﻤﺮﻭﺭﻳﺔ-",
+    "F. S. T. Co - Aﺷﺮﻛﺔ ﺍﻣﺪﺍﺩ ﺍﻷﻁ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊCITY: 0000682016SAM RAS TANOURAH MADA***1502 VAT CHRG: 0. 00 0. 00",
+    "ﺗﺤﻮﻳﻞ ﺩﺍﺧﻠﻲ ﺻﺎﺩﺭ NCBK82824148ALPO / ﺭﺳﻮﻡ ﺣﻮﺍﻟﺔ",
+    "BRIGHT STAGEﻣﺆﺳﺴﺔ ﺍﻟﻤﻨﺼﺔ ﺍﻝ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊEV CITY: 0000682016SAM KHOBAR MADA***1502 VAT CHRG: 0. 00 0. 00",
+    "CITY: Digital Channel ﺭﺳﻮﻡ ﺗﺤﻮﻳﻞ",
+    "CITY: Digital Channel ﺿﺮﻳﺒﺔ ﺍﻟﻘﻴﻤﺔ ﺍﻟﻤﻀﺎﻓﺔ",
+    "CARD: 430259 PAYMENT ﻣﺪﻓﻮﻋﺎﺕ ﺑﻄﺎﻗﺔ ﺇﺋﺘﻤﺎﻧﻴﺔ",
+    "Musaned Contrac ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖCITY: 0000682016SAM Riyadh MADA ***1502VAT CHRG: 0. 00 0. 00",
+    "Coarse Grind ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊ - ﻣﺪﻯ ﺃﺛﻴﺮ ﻛﻮﺭﺱ ﺟﺮﺍﻳﻨﺪCITY: 0000682016SAM JEDDAH MADA ***8768VAT CHRG: 0. 00 0. 00",
+    "AYA MALL BINDAWﺑﻦ ﺩﺍﻭﻭﺩ ﺁﻳﺎ ﻣﻮ Apple Pay - ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊCITY: 0000682016SAM JEDDAH MADA ***8768VAT CHRG: 0. 00 0. 00",
+    "1234**** xxxx4321 الفخامة سبا إيداع راتب ID: 998877 RUH123SA RIYADH petrolat",
+    "digital channelxxxx4321youtube musicTRN: X9",
+    "ID: 12345 REF: ABC TRN: 99 TERMINAL: T1 MERCHANT: M2 1234567890123",
+    "SANBCBNK123456 xxxx1234 ****5678 1234****",
+    "‏مدفوعات سداد ٠٠٢ - الشركة السعودية للكهرباء‎",
+    "", "   ", "123", "xyz qwe",
+]
+
+# ضوضاء نقاط البيع والتحويلات
+POS_NOISE = [
+    "CITY: 0000682016SAM", "RIYADH", "JEDDAH", "MADA ***1502", "MADA***8768", "VAT CHRG: 0. 00 0. 00",
+    "VAT CHRG: 1.50 0.23", "Apple Pay -", "ﺷﺮﺍﺀ ﻋﺒﺮ ﻧﻘﺎﻁ ﺑﻴﻊ", "ﻋﻤﻠﻴﺔ ﺷﺮﺍﺀ ﻋﺒﺮ ﺍﻹﻧﺘﺮﻧﺖ", "POS", "online",
+    "tap", "store", "12345678901", "REF: X1", "TRN: X9", "ID: 998877", "MCC- 6540", "mcc-5411",
+    "TERMINAL: T77", "MERCHANT: M9", "SANBCBNK778899", "SA", "ABC SA", "JED SA", "JEDDAH MADA",
+    "JEDHAH MADA", "RUH123SA RIYADH", "JEDH682016JED", "xxxx4321", "1234****", "****5678", "xxxxxx",
+    "digital channel", "stc pay", "visa", "mada", "Google Pay", "CITY:", "KHOBAR", "DAMMAM",
+    "٠١٢٣", "-", "/", "*",
+]
+
+
+def build_corpus(categories, merchants, size=3000, seed=20240701):
+    """أوصاف ثابتة لنفس القاموس وقائمة التجار"""
+    rnd = random.Random(seed)
+    keywords = [keyword for subcategories in categories.values()
+                for keywords in subcategories.values() for keyword in keywords]
+    merchant_names = list(merchants)
+
+    corpus = list(STATEMENT_SAMPLES)
+    while len(corpus) < size:
+        source = keywords if rnd.random() < 0.8 else merchant_names
+        parts = [rnd.choice(source)] + rnd.sample(POS_NOISE, rnd.randint(0, 4))
+        if rnd.random() < 0.2:
+            parts.append(rnd.choice(keywords))
+        rnd.shuffle(parts)
+        description = ' '.join(parts)
+
+        variant = rnd.random()
+        if variant < 0.15:
+            description = description.upper()
+        elif variant < 0.25:
+            description = description.replace(' ', '')
+        elif variant < 0.35:
+            description = description + rnd.choice(keywords)
+        elif variant < 0.40:
+            description = description.lower()
+        corpus.append(description)
+
+    return corpus
+
+
+def golden_record(module, description):
+    """نتائج وصف واحد بالشكل المحفوظ في الملف المرجعي"""
+    return {
+        'description': description,
+        'normalized': module.normalize_arabic_text(description),
+        'clean': module.clean_for_classification(description, preserve_keywords=True),
+        'clean_all': module.clean_for_classification(description, preserve_keywords=False),
+        'keyword_category': list(module._original_classify_transaction(description)),
+        'category': list(module.classify_transaction(description)),
+    }
+
+
+if __name__ == "__main__":
+    # التوليد في مجلد مؤقت حتى يبدأ نظام التعلم بدون أنماط محفوظة
+    reference = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else '.')
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, reference)
+    import expense_categories as reference_module
+
+    corpus = build_corpus(reference_module.EXPENSE_CATEGORIES, reference_module.MERCHANT_DATABASE)
+    records = [golden_record(reference_module, description) for description in corpus]
+    json.dump(records, sys.stdout, ensure_ascii=False, indent=0)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+كشف نوع البنك من أول 3 صفحات: بصمة الراجحي في أي صفحة تتقدم على بصمات الأهلي العامة
+"""
+
+import pytest
+
+app = pytest.importorskip('app')
+
+from statement_pdf import write_statement_pdf
+
+
+class FakeDocument:
+    """مستند بنصوص صفحات ثابتة (بدون PDF)"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.page_count = len(pages)
+        self.bank_type = None
+
+    def page_text(self, page_num):
+        return self.pages[page_num]
+
+    def page_tables(self, page_num, settings=None):
+        return []
+
+
+@pytest.fixture(autouse=True)
+def pdfplumber_text(monkeypatch):
+    monkeypatch.setattr(app, 'PYMUPDF_AVAILABLE', False)
+
+
+def test_rajhi_on_later_page_wins_over_generic_ahli():
+    document = FakeDocument(["Account statement SNB transfer", "Al Rajhi Bank 920 003 344"])
+    assert app._detect_bank_type(document) == 'الراجحي'
+
+
+def test_ahli_detected_without_rajhi():
+    document = FakeDocument(["Account statement", "البنك الأهلي السعودي", "page 3"])
+    assert app._detect_bank_type(document) == 'الأهلي'
+
+
+def test_rajhi_on_first_page():
+    document = FakeDocument(["مصرف الراجحي ncb", "SNB"])
+    assert app._detect_bank_type(document) == 'الراجحي'
+
+
+@pytest.mark.parametrize('title, bank', [
+    ('Saudi National Bank - Account Statement', 'الأهلي'),
+    ('Al Rajhi Bank - Account Statement', 'الراجحي'),
+])
+def test_pymupdf_detection_matches_pdfplumber(tmp_path, monkeypatch, title, bank):
+    pytest.importorskip('fitz')
+    path = write_statement_pdf(str(tmp_path / 'statement.pdf'), title=title, pages=3)
+
+    monkeypatch.setattr(app, 'PYMUPDF_AVAILABLE', True)
+    with app.PDFDocument(path) as document:
+        assert app._detect_bank_type(document) == bank
+        # النص من PyMuPDF وحده، بدون فتح المستند بـ pdfplumber
+        assert document._plumber is None
+
+    monkeypatch.setattr(app, 'PYMUPDF_AVAILABLE', False)
+    with app.PDFDocument(path) as document:
+        assert app._detect_bank_type(document) == bank
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+قاموس التصنيفات من ملف خارجي: الحفظ الذري ومراقبة التغييرات
+"""
+
+import json
+import logging
+
+import pytest
+
+import expense_categories as ec
+
+
+def test_save_then_load_round_trip(tmp_path):
+    path = str(tmp_path / 'categories.json')
+    ec.save_categories_file(path)
+
+    assert ec.load_categories_file(path) == ec.get_keyword_index().categories
+    # لا يبقى الملف المؤقت بعد الاستبدال
+    assert [p.name for p in tmp_path.iterdir()] == ['categories.json']
+
+
+def test_watch_loop_logs_invalid_file(tmp_path, monkeypatch, caplog):
+    path = tmp_path / 'categories.json'
+    path.write_text(json.dumps(["ليس قاموساً"]), encoding='utf-8')
+    watcher = ec.CategoriesFileWatcher(str(path))
+
+    # دورة واحدة من الحلقة ثم الخروج منها
+    sleeps = []
+    def sleep_once(_):
+        if sleeps:
+            raise SystemExit
+        sleeps.append(_)
+    monkeypatch.setattr(ec.time, 'sleep', sleep_once)
+
+    with caplog.at_level(logging.WARNING, logger=ec.__name__), pytest.raises(SystemExit):
+        watcher._watch_loop()
+
+    assert str(path) in caplog.text
+
+
+def test_keyword_categories_follows_install(monkeypatch, fresh_cache):
+    monkeypatch.setattr(ec, 'EXPENSE_CATEGORIES', ec.EXPENSE_CATEGORIES)
+    monkeypatch.setattr(ec, '_keyword_index', ec._keyword_index)
+    categories = {"🛒 سوبرماركت وبقالة": {"سوبرماركت كبير": ["carrefour"]}}
+
+    ec.install_categories(categories)
+
+    assert ec.KEYWORD_CATEGORIES is categories
+
+
+def test_install_publishes_index_before_categories(monkeypatch, fresh_cache):
+    monkeypatch.setattr(ec, 'EXPENSE_CATEGORIES', ec.EXPENSE_CATEGORIES)
+    monkeypatch.setattr(ec, '_keyword_index', ec._keyword_index)
+    old_categories = ec.EXPENSE_CATEGORIES
+    categories = {"🛒 سوبرماركت وبقالة": {"سوبرماركت كبير": ["carrefour"]}}
+
+    index = ec.install_categories(categories)
+
+    # قارئ بين نشر الفهرس وتحديث الاسم العام يرى الفهرس الجديد ولا يعيد بناءه
+    monkeypatch.setattr(ec, 'EXPENSE_CATEGORIES', old_categories)
+    assert ec.get_keyword_index() is index
+    with ec.keyword_index_snapshot() as pinned:
+        assert pinned is index
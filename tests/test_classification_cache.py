@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+الذاكرة الدائمة لا تغير نتائج التصنيف: نفس نتائج classify_transaction بنفس الترتيب
+"""
+
+import json
+
+import expense_categories as ec
+from golden_corpus import GOLDEN_FILE
+
+UNCLASSIFIED = ("❓ غير مصنف", "غير محدد")
+
+# "ZORBA QWERTY" غير معروف، ثم يُتعلم كتاجر من الوصف الثاني
+LEARNED_MERCHANT = ['ZORBA QWERTY 1', 'ZORBA QWERTY CARREFOUR', 'ZORBA QWERTY 1']
+
+
+def test_cached_follows_learning(fresh_learner, new_learner, fresh_cache):
+    results = [ec.classify_cached(description) for description in LEARNED_MERCHANT]
+
+    new_learner()
+    expected = [ec.classify_transaction(description) for description in LEARNED_MERCHANT]
+
+    assert results == expected
+    assert results[0] == UNCLASSIFIED and results[2] != UNCLASSIFIED
+
+
+def test_unclassified_results_are_not_persisted(fresh_learner, fresh_cache):
+    ec.classify_cached(LEARNED_MERCHANT[0])
+
+    key = ec.PersistentClassificationCache.make_key(LEARNED_MERCHANT[0], ec.get_ruleset_version())
+    assert fresh_cache.get(key) is None
+
+
+def test_cache_hits_still_learn(fresh_learner, new_learner, fresh_cache):
+    ec.classify_many(LEARNED_MERCHANT[1:2])
+
+    # نفس الذاكرة الدائمة مع نظام تعلم جديد: الوصف الثاني يؤخذ من الذاكرة ويجب أن يُتعلم منه
+    new_learner()
+    results = ec.classify_many(LEARNED_MERCHANT)
+
+    new_learner()
+    assert results == [ec.classify_transaction(description) for description in LEARNED_MERCHANT]
+
+
+def test_classify_many_matches_golden(fresh_learner, new_learner, fresh_cache):
+    with open(GOLDEN_FILE, encoding='utf-8') as f:
+        golden = json.load(f)
+    descriptions = [record['description'] for record in golden]
+    expected = [tuple(record['category']) for record in golden]
+
+    assert ec.classify_many(descriptions) == expected
+
+    # المرة الثانية من الذاكرة الدائمة
+    new_learner()
+    assert ec.classify_many(descriptions) == expected
+
+
+def test_writes_keep_rows_of_other_versions(fresh_cache):
+    # عمليتان بإصدارين مختلفين تكتبان في نفس الملف
+    fresh_cache.put('old-key', 'old', ('🛒', 'سوبرماركت'))
+    fresh_cache.put('new-key', 'new', ('🛒', 'سوبرماركت'))
+    assert fresh_cache.get('old-key') is not None
+
+    fresh_cache.purge('new')
+    assert fresh_cache.get('old-key') is None
+    assert fresh_cache.get('new-key') is not None
+
+
+def test_install_categories_purges_other_versions(fresh_cache, monkeypatch):
+    monkeypatch.setattr(ec, 'EXPENSE_CATEGORIES', ec.EXPENSE_CATEGORIES)
+    monkeypatch.setattr(ec, '_keyword_index', ec._keyword_index)
+    fresh_cache.put('old-key', 'old', ('🛒', 'سوبرماركت'))
+
+    ec.install_categories(dict(ec.EXPENSE_CATEGORIES))
+
+    assert fresh_cache.get('old-key') is None
+
+
+def test_first_classification_purges_other_versions(fresh_learner, fresh_cache):
+    fresh_cache.put('old-key', 'old', ('🛒', 'سوبرماركت'))
+    ec.classify_many(LEARNED_MERCHANT[1:2])
+    assert fresh_cache.get('old-key') is None
+
+    # مرة واحدة لكل عملية: الإصدارات الأخرى لا تُحذف في كل تصنيف
+    fresh_cache.put('old-key', 'old', ('🛒', 'سوبرماركت'))
+    ec.classify_many(LEARNED_MERCHANT[1:2])
+    assert fresh_cache.get('old-key') is not None
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+اختبارات ثبات النتائج مقابل الملف المرجعي tests/golden_classification.json
+(المولد من النسخة السابقة لتحسينات الأداء، انظر tests/golden_corpus.py)
+"""
+
+import json
+
+import pytest
+
+import expense_categories as ec
+from golden_corpus import GOLDEN_FILE
+
+
+@pytest.fixture(scope='module')
+def golden():
+    with open(GOLDEN_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_normalize_matches_golden(golden):
+    mismatches = [record['description'] for record in golden
+                  if ec.normalize_arabic_text(record['description']) != record['normalized']]
+    assert mismatches == []
+
+
+def test_clean_preserving_keywords_matches_golden(golden):
+    mismatches = [record['description'] for record in golden
+                  if ec.clean_for_classification(record['description'], preserve_keywords=True) != record['clean']]
+    assert mismatches == []
+
+
+def test_clean_all_matches_golden(golden):
+    mismatches = [record['description'] for record in golden
+                  if ec.clean_for_classification(record['description'], preserve_keywords=False) != record['clean_all']]
+    assert mismatches == []
+
+
+def test_keyword_classification_matches_golden(golden):
+    mismatches = [record['description'] for record in golden
+                  if list(ec._original_classify_transaction(record['description'])) != record['keyword_category']]
+    assert mismatches == []
+
+
+def test_enhanced_classification_matches_golden(golden, fresh_learner):
+    # نتيجة الوصف تعتمد على ما تعلمه النظام مما قبله، لذا يُصنف بنفس الترتيب
+    mismatches = [record['description'] for record in golden
+                  if list(ec.classify_transaction(record['description'])) != record['category']]
+    assert mismatches == []
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+عدة عمليات تشارك ملفات التعلم (لقطة + سجل): لا يضيع حدث ولا يتكرر رقم
+كل مثيل هنا يمثل عملية مستقلة تفتح نفس الملفات
+"""
+
+import json
+import logging
+
+import expense_categories as ec
+
+
+def _learner(path):
+    return ec.ClassificationLearner(filename=str(path))
+
+
+def _journal_seqs(path):
+    with open(str(path) + '.journal', encoding='utf-8') as f:
+        return [json.loads(line)["seq"] for line in f]
+
+
+def test_journal_seqs_are_unique_across_learners(tmp_path):
+    path = tmp_path / 'patterns.json'
+    first, second = _learner(path), _learner(path)
+
+    first.learn_pattern('CARREFOUR RIYADH', 'سوبرماركت', 'كبير')
+    second.learn_pattern('STARBUCKS KHOBAR', 'مقاهي', 'قهوة')
+    first.flush()
+    second.flush()
+    first.learn_pattern('CARREFOUR RIYADH', 'سوبرماركت', 'كبير')
+    first.flush()
+
+    seqs = _journal_seqs(path)
+    assert len(seqs) == len(set(seqs)) == 3
+
+    patterns = _learner(path).patterns["patterns"]
+    assert patterns['carrefour riyadh']['count'] == 2
+    assert patterns['starbucks khobar']['count'] == 1
+
+
+def test_compact_keeps_events_of_other_learners(tmp_path):
+    path = tmp_path / 'patterns.json'
+    first, second = _learner(path), _learner(path)
+
+    second.learn_pattern('STARBUCKS KHOBAR', 'مقاهي', 'قهوة')
+    second.flush()
+    first.learn_pattern('CARREFOUR RIYADH', 'سوبرماركت', 'كبير')
+    first.compact()
+
+    # الثانية تكتب بعد ضغط الأولى للسجل، ولا تُتجاهل أحداثها عند التحميل
+    second.learn_pattern('STARBUCKS KHOBAR', 'مقاهي', 'قهوة')
+    second.flush()
+
+    patterns = _learner(path).patterns["patterns"]
+    assert patterns['starbucks khobar']['count'] == 2
+    assert patterns['carrefour riyadh']['count'] == 1
+    assert second.patterns["patterns"]['carrefour riyadh']['count'] == 1
+
+
+def test_failed_snapshot_write_is_logged(tmp_path, monkeypatch, caplog):
+    learner = _learner(tmp_path / 'patterns.json')
+    learner.learn_pattern('CARREFOUR RIYADH', 'سوبرماركت', 'كبير')
+
+    def failing_write(path, payload, prefix):
+        raise OSError('disk full')
+    monkeypatch.setattr(ec, '_atomic_write', failing_write)
+
+    with caplog.at_level(logging.WARNING, logger=ec.__name__):
+        learner.compact()
+
+    assert 'disk full' in caplog.text
+
+
+def test_failed_flush_keeps_events_pending(tmp_path, caplog):
+    path = tmp_path / 'patterns.json'
+    learner = _learner(path)
+    learner.learn_pattern('CARREFOUR RIYADH', 'سوبرماركت', 'كبير')
+
+    # مجلد بدل ملف السجل: الإلحاق يفشل
+    journal = tmp_path / 'patterns.json.journal'
+    journal.mkdir()
+    with caplog.at_level(logging.WARNING, logger=ec.__name__):
+        learner.flush()
+    assert str(journal) in caplog.text
+
+    journal.rmdir()
+    learner.flush()
+
+    assert _learner(path).patterns["patterns"]['carrefour riyadh']['count'] == 1
+
+
+def test_reload_after_compaction_keeps_pending_merchants(tmp_path):
+    path = tmp_path / 'patterns.json'
+    first, second = _learner(path), _learner(path)
+
+    first.learn_pattern('STARBUCKS KHOBAR 1', 'مقاهي', 'قهوة')
+    second.learn_pattern('CARREFOUR RIYADH 2', 'سوبرماركت', 'كبير')
+    second.compact()
+
+    # الأولى تعيد التحميل بعد ضغط الثانية، وحدثها المعلق في الأنماط والفهرس معاً
+    first._sync_with_store()
+    assert first.get_learned_classification('starbucks khobar 9') == ('مقاهي', 'قهوة')
+    assert first.get_learned_classification('carrefour riyadh 9') == ('سوبرماركت', 'كبير')
+
+
+def test_unreadable_journal_loads_snapshot_alone(tmp_path, caplog):
+    path = tmp_path / 'patterns.json'
+    learner = _learner(path)
+    learner.learn_pattern('CARREFOUR RIYADH', 'سوبرماركت', 'كبير')
+    learner.compact()
+
+    # مجلد بدل ملف السجل: التحميل يكتفي باللقطة بدل أن يفشل الاستيراد
+    journal = tmp_path / 'patterns.json.journal'
+    journal.unlink()
+    journal.mkdir()
+    with caplog.at_level(logging.WARNING, logger=ec.__name__):
+        reloaded = _learner(path)
+
+    assert str(journal) in caplog.text
+    assert reloaded.patterns["patterns"]['carrefour riyadh']['count'] == 1
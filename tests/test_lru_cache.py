@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+ذاكرة TransactionClassifier المؤقتة: حجم محدود، حذف الأقدم استخداماً، وعدادات صحيحة
+"""
+
+import expense_categories as ec
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ec.LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    # 'b' هو الأقدم استخداماً بعد قراءة 'a'
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+
+def test_amounts_share_one_cache_entry(fresh_learner):
+    classifier = ec.TransactionClassifier(cache_size=2)
+
+    first = classifier.classify('CARREFOUR RIYADH', amount=50)
+    second = classifier.classify('CARREFOUR RIYADH', amount=120)
+
+    assert first == second
+    assert classifier.cache.stats() == {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 1, 'evictions': 0}
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+تطبيع النص: حذف أحرف الفئة C كما في الطريقة الأصلية (حرفاً بحرف عبر unicodedata)
+"""
+
+import random
+import sys
+import unicodedata
+
+import expense_categories as ec
+
+
+def _reference(text):
+    text = unicodedata.normalize('NFKC', text)
+    text = ''.join(char for char in text if unicodedata.category(char)[0] != 'C')
+    return text.translate(ec._NORMALIZE_TABLE)
+
+
+def test_control_characters_removed_like_reference():
+    rnd = random.Random(12)
+    code_points = [code_point for code_point in range(sys.maxunicode + 1) if not 0xD800 <= code_point <= 0xDFFF]
+    samples = ['‏مدفوعات سداد‎', 'STC​ Pay\x00\x1f', 'abc\U000e0001']
+    samples += [''.join(chr(rnd.choice(code_points)) for _ in range(30)) for _ in range(500)]
+
+    assert [ec.normalize_arabic_text(text) for text in samples] == [_reference(text) for text in samples]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+التصنيف المتوازي يعطي نفس النتائج ونفس ما يتعلمه النظام مهما كان عدد العمليات
+"""
+
+import json
+import multiprocessing
+
+import pytest
+
+import expense_categories as ec
+from golden_corpus import GOLDEN_FILE
+
+pytestmark = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                                reason="التصنيف المتوازي يتطلب fork")
+
+
+def _classify(descriptions, workers, new_learner, new_cache):
+    learner = new_learner()
+    new_cache()
+
+    results = ec.classify_many(descriptions, workers=workers)
+    learned = {key: (pattern['category'], pattern['subcategory'], pattern['count'])
+               for key, pattern in learner.patterns['patterns'].items()}
+    return results, learned, learner.patterns['merchants']
+
+
+def test_workers_do_not_change_results(new_learner, new_cache, monkeypatch):
+    monkeypatch.setattr(ec, 'PARALLEL_CLASSIFICATION_THRESHOLD', 1)
+    with open(GOLDEN_FILE, encoding='utf-8') as f:
+        descriptions = [record['description'] for record in json.load(f)]
+
+    sequential = _classify(descriptions, 1, new_learner, new_cache)
+    parallel = _classify(descriptions, 4, new_learner, new_cache)
+
+    assert parallel == sequential
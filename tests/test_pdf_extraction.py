@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+مسارات استخراج كشف PDF مولد بـ PyMuPDF تعطي نفس نتيجة analyze_single_file:
+التسلسلي، والمتوازي (مع فشل عملية فرعية)، والعودة إلى pdfplumber
+"""
+
+import logging
+
+import pytest
+
+fitz = pytest.importorskip('fitz')
+app = pytest.importorskip('app')
+
+import expense_categories as ec
+from statement_pdf import PAGES, ROWS_PER_PAGE, write_statement_pdf
+
+_original_extract_page_range = app._extract_page_range
+
+
+def _failing_extract_page_range(task):
+    # تُستدعى في العملية الفرعية: نطاق الصفحة الرابعة يفشل
+    if task[2] <= 3 < task[3]:
+        raise RuntimeError('worker failed')
+    return _original_extract_page_range(task)
+
+
+@pytest.fixture(scope='module')
+def statement_pdf(tmp_path_factory):
+    """كشف الأهلي بجدول مرسوم الحدود في كل صفحة"""
+    return write_statement_pdf(str(tmp_path_factory.mktemp('pdf') / 'statement.pdf'))
+
+
+@pytest.fixture
+def analyze(new_learner, new_cache):
+    """analyze_single_file بنظام تعلم وذاكرة تصنيف فارغين في كل استدعاء"""
+    def run(path):
+        new_learner()
+        new_cache()
+        return app.analyze_single_file(path)
+    return run
+
+
+@pytest.fixture
+def serial_result(statement_pdf, analyze, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'EXTRACTION_WORKERS', 1)
+    result = analyze(statement_pdf)
+    assert result['summary']['totalOperations'] == PAGES * ROWS_PER_PAGE
+    return result
+
+
+@pytest.fixture
+def parallel_calls(monkeypatch):
+    """تشغيل المسار المتوازي مع تسجيل استدعاءاته"""
+    monkeypatch.setitem(app.app.config, 'EXTRACTION_WORKERS', 2)
+    monkeypatch.setitem(app.app.config, 'PARALLEL_EXTRACTION_MIN_PAGES', 2)
+    calls = []
+    original = app._iter_pages_parallel
+
+    def spy(*args):
+        calls.append(args[2])
+        return original(*args)
+    monkeypatch.setattr(app, '_iter_pages_parallel', spy)
+    return calls
+
+
+def test_parallel_matches_serial(serial_result, statement_pdf, analyze, parallel_calls):
+    assert analyze(statement_pdf) == serial_result
+    assert parallel_calls == [PAGES]
+
+
+def test_failed_worker_continues_in_process(serial_result, statement_pdf, analyze, parallel_calls,
+                                            monkeypatch, caplog):
+    monkeypatch.setattr(app, '_extract_page_range', _failing_extract_page_range)
+
+    with caplog.at_level(logging.WARNING, logger=app.app.logger.name):
+        assert analyze(statement_pdf) == serial_result
+
+    assert parallel_calls == [PAGES]
+    # يُكمل من الصفحة التي فشل نطاقها، لا من بداية الملف
+    assert 'الصفحة 4' in caplog.text
+    assert 'خطأ في PyMuPDF' not in caplog.text
+
+
+def test_pdfplumber_matches_pymupdf(serial_result, statement_pdf, analyze, monkeypatch):
+    monkeypatch.setattr(app, 'PYMUPDF_AVAILABLE', False)
+    assert analyze(statement_pdf) == serial_result
+
+
+
+def test_failed_pymupdf_pass_classifies_nothing(serial_result, statement_pdf, analyze, monkeypatch):
+    # المصاريف تُصنف (وتُتعلم) بعد اكتمال مسار PyMuPDF فقط، فلا تُتعلم مرتين إذا أُعيدت بمسار العودة
+    classified = []
+    classify_many = app.classify_many
+
+    def spy(descriptions, **kwargs):
+        classified.append(len(descriptions))
+        return classify_many(descriptions, **kwargs)
+    monkeypatch.setattr(app, 'classify_many', spy)
+    original = app.extract_with_pymupdf
+    classified_before_failure = []
+
+    def failing_extract(document):
+        for page_num, page_data in enumerate(original(document)):
+            if page_num == 3:
+                classified_before_failure.extend(classified)
+                raise RuntimeError('mupdf failed')
+            yield page_data
+    monkeypatch.setattr(app, 'extract_with_pymupdf', failing_extract)
+
+    assert analyze(statement_pdf) == serial_result
+    assert classified_before_failure == []
+    assert classified
+
+
+def test_pdfplumber_pages_share_one_keyword_index(serial_result, statement_pdf, analyze, monkeypatch):
+    # استبدال القاموس بعد تصنيف الصفحة الأولى لا يغير الفهرس المستخدم لبقية صفحات نفس الكشف
+    monkeypatch.setattr(app, 'PYMUPDF_AVAILABLE', False)
+    indexes = []
+    classify_many = app.classify_many
+
+    def spy(descriptions, **kwargs):
+        indexes.append(ec.get_keyword_index())
+        monkeypatch.setattr(ec, 'EXPENSE_CATEGORIES', dict(ec.EXPENSE_CATEGORIES))
+        return classify_many(descriptions, **kwargs)
+    monkeypatch.setattr(app, 'classify_many', spy)
+
+    assert analyze(statement_pdf) == serial_result
+    assert len(indexes) == PAGES
+    assert all(index is indexes[0] for index in indexes)
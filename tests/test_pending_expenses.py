@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+تصنيف مصاريف عدة ملفات معاً يعطي نفس نتيجة تصنيفها واحداً بعد الآخر بترتيب استخراجها
+"""
+
+from collections import defaultdict
+
+import pytest
+
+app = pytest.importorskip('app')
+
+import expense_categories as ec
+
+DESCRIPTIONS = ['POS PURCHASE CARREFOUR', 'STC BILL PAYMENT', 'UBER TRIP', 'PANDA HYPERMARKET', '']
+
+
+def _pending_expenses():
+    # ملفات من بنكين بالتناوب، والأوصاف تتكرر بين الملفات
+    pending = []
+    for file_num in range(4):
+        bank = 'الراجحي' if file_num % 2 else None
+        for n in range(10):
+            pending.append((bank, {"desc": DESCRIPTIONS[(file_num + n) % len(DESCRIPTIONS)], "amount": n}))
+    return pending
+
+
+def _learned(learner):
+    return {key: (pattern['category'], pattern['subcategory'], pattern['count'])
+            for key, pattern in learner.patterns['patterns'].items()}
+
+
+def test_combined_classification_keeps_extraction_order(new_learner, fresh_cache):
+    pending = _pending_expenses()
+
+    sequential_learner = new_learner()
+    sequential = defaultdict(list)
+    for bank, record in pending:
+        if record["desc"]:
+            category = app.format_expense_category(*ec.classify_cached(record["desc"], bank=bank))
+        else:
+            category = "❓ غير مصنف"
+        sequential[category].append(record)
+
+    combined_learner = new_learner()
+    combined = defaultdict(list)
+    app.classify_pending_expenses(pending, combined)
+
+    assert combined == sequential
+    assert _learned(combined_learner) == _learned(sequential_learner)
+
+
+def test_alternating_banks_classify_in_one_call(fresh_learner, fresh_cache, monkeypatch):
+    calls = []
+    classify_many = app.classify_many
+
+    def spy(descriptions, **kwargs):
+        calls.append(len(descriptions))
+        return classify_many(descriptions, **kwargs)
+    monkeypatch.setattr(app, 'classify_many', spy)
+
+    pending = _pending_expenses()
+    app.classify_pending_expenses(pending, defaultdict(list))
+
+    assert calls == [sum(1 for bank, record in pending if record["desc"])]
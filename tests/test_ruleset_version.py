@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+إصدار القواعد (مفتاح الذاكرة الدائمة) يتغير مع أي تعديل على القاموس أو قاعدة التجار
+"""
+
+import copy
+
+import pytest
+
+import expense_categories as ec
+
+UNKNOWN = 'ZORBAQWERTY'
+
+
+@pytest.fixture
+def categories(monkeypatch):
+    """نسخة من القاموس يمكن تعديلها في مكانها، وتُستعاد الفهارس بعد الاختبار"""
+    categories = copy.deepcopy(ec.EXPENSE_CATEGORIES)
+    monkeypatch.setattr(ec, 'EXPENSE_CATEGORIES', categories)
+    monkeypatch.setattr(ec, '_keyword_index', ec._keyword_index)
+    return categories
+
+
+def test_same_count_keyword_edit_changes_version(categories):
+    version = ec.get_ruleset_version()
+
+    keywords = categories["🛒 سوبرماركت وبقالة"]["سوبرماركت كبير"]
+    keywords[0] = UNKNOWN
+
+    assert ec.get_ruleset_version() != version
+    with ec.keyword_index_snapshot() as index:
+        assert UNKNOWN.lower() in index.keywords
+    assert ec._original_classify_transaction(UNKNOWN)[1] == "سوبرماركت كبير"
+
+
+def test_in_place_merchant_edit_changes_version(monkeypatch):
+    merchants = dict(ec.MERCHANT_DATABASE)
+    monkeypatch.setattr(ec, 'MERCHANT_DATABASE', merchants)
+    monkeypatch.setattr(ec, '_merchant_matcher', ec._merchant_matcher)
+    version = ec.get_ruleset_version()
+
+    merchant = next(iter(merchants))
+    merchants[merchant] = ("🎧 اشتراكات تلقائية", "خدمات آبل")
+
+    assert ec.get_ruleset_version() != version
+    assert ec.get_merchant_matcher().find(merchant.casefold()) == (merchant, merchants[merchant])
+
+
+def test_merchant_content_checked_once_per_run(monkeypatch, fresh_learner, fresh_cache):
+    calls = []
+    content_hash = ec._merchants_content_hash
+    monkeypatch.setattr(ec, '_merchants_content_hash', lambda merchants: calls.append(1) or content_hash(merchants))
+
+    ec.classify_many([f'CARREFOUR {number}' for number in range(50)])
+
+    assert len(calls) == 1
+
+
+def test_classify_batch_checks_rules_once(monkeypatch, fresh_learner):
+    calls = []
+    content_hash = ec._categories_content_hash
+    monkeypatch.setattr(ec, '_categories_content_hash', lambda categories: calls.append(1) or content_hash(categories))
+
+    classifier = ec.TransactionClassifier()
+    classifier.classify_batch([{"description": f'CARREFOUR {number}'} for number in range(50)])
+
+    assert len(calls) == 1
+
+
+def test_priority_rules_change_version(monkeypatch):
+    version = ec.get_ruleset_version()
+
+    rule = ec.PRIORITY_RULES[0]
+    changed = rule._replace(keywords=rule.keywords + (UNKNOWN,))
+    monkeypatch.setattr(ec, 'PRIORITY_RULES', (changed,) + ec.PRIORITY_RULES[1:])
+
+    assert ec.get_ruleset_version() != version
+
+
+def test_schema_version_changes_version(monkeypatch):
+    version = ec.get_ruleset_version()
+    monkeypatch.setattr(ec, 'RULES_SCHEMA_VERSION', ec.RULES_SCHEMA_VERSION + 1)
+    assert ec.get_ruleset_version() != version